@@ -0,0 +1,224 @@
+import argparse
+import datetime
+import gzip
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+
+import log_analyzer as la
+
+LOG_LINE = '{ip} -  - [29/Jun/2017:03:50:22 +0300] "GET {url} HTTP/1.1" 200 927 "-" ' \
+           '"Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" ' \
+           '"1498697422-2190034393-4708-9752759" "dc7161be3" {time:.3f}\n'
+
+
+REPORT_TEMPLATE = '<html><script>var table = $table_json;</script></html>'
+WRITE_BATCH = 10000
+
+
+def generate_lines(n_lines, n_urls=1000, error_rate=0.01, seed=42):
+    rnd = random.Random(seed)
+    for _ in range(n_lines):
+        if rnd.random() < error_rate:
+            yield 'broken line {}\n'.format(rnd.randrange(n_lines))
+            continue
+        yield LOG_LINE.format(ip='1.196.116.{}'.format(rnd.randrange(256)),
+                              url='/api/v2/banner/{}'.format(rnd.randrange(n_urls)),
+                              time=rnd.expovariate(5))
+
+
+def generate_log(log_dir, n_lines, n_urls=1000, error_rate=0.01, gz=False, seed=42):
+    # имя файла зависит от параметров, поэтому сгенерированный лог переиспользуется между запусками
+    name = 'nginx-access-ui.log-20170630-{}-{}-{}-{}'.format(n_lines, n_urls, error_rate, seed)
+    path_to_file = os.path.join(log_dir, name + ('.gz' if gz else ''))
+    if not os.path.exists(path_to_file):
+        tmp_path = path_to_file + '.tmp'
+        with (gzip.open(tmp_path, 'wt') if gz else open(tmp_path, 'w')) as f:
+            batch = []
+            for line in generate_lines(n_lines, n_urls, error_rate, seed):
+                batch.append(line)
+                if len(batch) >= WRITE_BATCH:
+                    f.writelines(batch)
+                    batch = []
+            f.writelines(batch)
+        os.replace(tmp_path, path_to_file)
+    return la.FILE_LOG(name=os.path.basename(path_to_file), date=datetime.date(2017, 6, 30),
+                       ext='.gz' if gz else None, path_to_file=path_to_file)
+
+
+def run_pipeline(file_log, config):
+    metrics = la.Metrics()
+    with tempfile.TemporaryDirectory() as report_dir:
+        with open(os.path.join(report_dir, 'report.html'), 'w') as f:
+            f.write(REPORT_TEMPLATE)
+        with metrics.stage('parse'):
+            dict_url = la.read_file(file_log, error_percent=1., workers=config['WORKERS'],
+                                    options=la.get_parse_options(config), metrics=metrics)
+        with metrics.stage('aggregate'):
+            stat = la.compute_stat(dict_url, config['REPORT_SIZE'])
+        with metrics.stage('render'):
+            la.create_report(report_dir, os.path.join(report_dir, 'report-bench.html'), stat)
+    return metrics.as_dict()
+
+
+def send_pipeline_result(conn, file_log, config):
+    conn.send(run_pipeline(file_log, config))
+
+
+def run_pipeline_in_process(file_log, config):
+    # отдельный процесс на сценарий, чтобы peak RSS не накапливался между размерами
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=send_pipeline_result, args=(child_conn, file_log, config))
+    process.start()
+    result = parent_conn.recv()
+    process.join()
+    return result
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_pipeline(args):
+    config = dict(la.LOCAL_CONFIG, WORKERS=args.workers, PARSER=args.parser, MEDIAN_MODE=args.median_mode,
+                  AGG_BACKEND=args.backend)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_dir = args.data_dir or tmp_dir
+        os.makedirs(log_dir, exist_ok=True)
+        for n_lines in args.lines:
+            file_log = generate_log(log_dir, n_lines, args.urls, args.error_rate, args.gzip, args.seed)
+            result = run_pipeline_in_process(file_log, config)
+            result['params'] = {'lines': n_lines, 'urls': args.urls, 'error_rate': args.error_rate,
+                                'gzip': args.gzip, 'workers': args.workers, 'parser': args.parser,
+                                'median_mode': args.median_mode, 'backend': args.backend, 'seed': args.seed}
+            print("{:>11} lines: parse {:.3f}s aggregate {:.3f}s render {:.3f}s, {} lines/sec, peak RSS {} KB".format(
+                n_lines, result['stages']['parse'], result['stages']['aggregate'], result['stages']['render'],
+                result['lines_per_sec'], result['peak_rss_kb']))
+            results.append(result)
+    output = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    return output
+
+
+def bench_parsers(lines):
+    results = {}
+    for name, parse_line in la.PARSERS.items():
+        start = time.perf_counter()
+        for line in lines:
+            parse_line(line)
+        elapsed = time.perf_counter() - start
+        results[name] = len(lines) / elapsed
+    return results
+
+
+def parse_gzip_text(path_to_file):
+    # прежний путь: gzip.open в текстовом режиме и разбор str построчно
+    with gzip.open(path_to_file, mode='rt') as f:
+        return la.parse_lines(f)
+
+
+def bench_gzip(lines, repeat=3):
+    # лучший из repeat прогонов: разница между путями меньше шума одиночного замера
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path_to_file = os.path.join(tmp_dir, 'nginx-access-ui.log-20170630.gz')
+        with gzip.open(path_to_file, 'wt') as f:
+            f.writelines(lines)
+        results = {}
+        for name, parse in [('text', parse_gzip_text),
+                            ('binary', la.parse_gzip),
+                            ('binary_thread', lambda path: la.parse_gzip(path, threaded=True))]:
+            elapsed = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                parse(path_to_file)
+                elapsed.append(time.perf_counter() - start)
+            results[name] = len(lines) / min(elapsed)
+        return results
+
+
+def compute_stat_full_sort(dict_url, report_size):
+    # прежняя реализация: строка со статистикой для каждого url и полная сортировка
+    total_times = sum(url_stat.time_sum for url_stat in dict_url.values())
+    total_count = sum(url_stat.count for url_stat in dict_url.values())
+    stat = [la.get_stat_row(url, url_stat, total_count, total_times) for url, url_stat in dict_url.items()]
+    stat = sorted(stat, key=lambda x: x['time_sum'], reverse=True)
+    return stat[:report_size]
+
+
+def generate_stats(n_urls, times_per_url=3, seed=42):
+    rnd = random.Random(seed)
+    dict_url = {}
+    for i in range(n_urls):
+        url_stat = dict_url['/api/v2/banner/{}?id={}'.format(i % 1000, i)] = la.UrlStat()
+        for _ in range(times_per_url):
+            url_stat.add(round(rnd.expovariate(5), 3))
+    return dict_url
+
+
+def bench_compute_stat(dict_url, report_size=1000):
+    results = {}
+    stats = []
+    for name, func in [('full_sort', compute_stat_full_sort), ('heap', la.compute_stat)]:
+        start = time.perf_counter()
+        stats.append(func(dict_url, report_size))
+        results[name] = time.perf_counter() - start
+    if stats[0] != stats[1]:
+        raise AssertionError('compute_stat output differs from full sort')
+    return results
+
+
+def bench_micro(args):
+    lines = list(generate_lines(args.lines))
+    for name, lines_per_sec in bench_parsers(lines).items():
+        print("{:<8} {:>12.0f} lines/sec".format(name, lines_per_sec))
+    for name, lines_per_sec in bench_gzip(lines).items():
+        print("gzip {:<14} {:>12.0f} lines/sec".format(name, lines_per_sec))
+    for name, elapsed in bench_compute_stat(generate_stats(args.urls)).items():
+        print("compute_stat {:<10} {:>8.3f} sec for {} urls".format(name, elapsed, args.urls))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    pipeline = subparsers.add_parser('pipeline', help='parse/aggregate/render on generated logs')
+    pipeline.add_argument("--lines", type=int, nargs='+', default=[10 ** 5, 10 ** 6])
+    pipeline.add_argument("--urls", type=int, default=1000)
+    pipeline.add_argument("--error-rate", type=float, default=0.01)
+    pipeline.add_argument("--gzip", action='store_true')
+    pipeline.add_argument("--seed", type=int, default=42)
+    pipeline.add_argument("--workers", type=int, default=1)
+    pipeline.add_argument("--parser", default='fast', choices=sorted(la.PARSERS))
+    pipeline.add_argument("--median-mode", default=la.MEDIAN_EXACT, choices=[la.MEDIAN_EXACT, la.MEDIAN_APPROX])
+    pipeline.add_argument("--backend", default=la.BACKEND_PYTHON, choices=[la.BACKEND_PYTHON, la.BACKEND_NUMPY])
+    pipeline.add_argument("--data-dir", help='keep generated logs here between runs')
+    pipeline.add_argument("--output", help='write results as JSON')
+    pipeline.set_defaults(func=bench_pipeline)
+
+    micro = subparsers.add_parser('micro', help='line parsers, gzip ingestion and compute_stat')
+    micro.add_argument("--lines", type=int, default=10 ** 5)
+    micro.add_argument("--urls", type=int, default=10 ** 6)
+    micro.set_defaults(func=bench_micro)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,33 @@ import json
 import logging
 import re
 import datetime
-from collections import namedtuple, defaultdict
+from collections import namedtuple
+from array import array
+import math
+import mmap
 import os
 import gzip
+import heapq
+import multiprocessing
+import queue
+import threading
+import pickle
 from statistics import median
 import string
+import functools
+import tempfile
+import time
+import zlib
+import cProfile
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 FILE_LOG = namedtuple('FILE_LOG', {'name':'', 'date':'', 'ext':'', 'path_to_file':''})
 
@@ -18,6 +40,9 @@ logging.basicConfig(level=logging.INFO,
                     datefmt="%Y.%m.%d %H:%M:%S",
                     filename=None)
 
+LOG_NAME_PREFIX = 'nginx-access-ui.log-'
+LOG_NAME_PATTERN = re.compile(r"^nginx-access-ui\.log-(\d{8})(\.gz)?$")
+
 LOG_PATTERN = re.compile(
     r"(?P<remote_addr>[\d\.]+)\s"
     r"(?P<remote_user>\S*)\s+"
@@ -34,18 +59,255 @@ LOG_PATTERN = re.compile(
     r"(?P<request_time>\d+\.\d+)\s*"
 )
 
+LOG_PATTERN_BYTES = re.compile(LOG_PATTERN.pattern.encode())
+
+# LOG_PATTERN, в котором поля в кавычках и time_local не содержат кавычек и ']': без ленивых
+# .*? он почти не откатывается. Если он совпал, LOG_PATTERN совпал бы с теми же request и
+# request_time; остальные строки перепроверяются LOG_PATTERN, поэтому ошибки считаются так же
+LOG_PATTERN_FAST = re.compile(
+    r"[\d\.]+\s\S*\s+\S*\s"
+    r"\[[^\]]*\]\s"
+    r'"(?P<request>[^"]*)"\s'
+    r"\d+\s\S*\s"
+    r'"[^"]*"\s"[^"]*"\s"[^"]*"\s"[^"]*"\s"[^"]*"\s'
+    r"(?P<request_time>\d+\.\d+)"
+)
+
+LOG_PATTERN_FAST_BYTES = re.compile(LOG_PATTERN_FAST.pattern.encode())
+
+GZIP_BLOCK_SIZE = 1024 * 1024
+
 LOCAL_CONFIG = {
     "REPORT_SIZE": 1000,
     "REPORT_DIR": "./reports",
     "LOG_DIR": "./log",
-    "ERROR_PERCENT": 0.4
+    "ERROR_PERCENT": 0.4,
+    "WORKERS": 1,
+    "MEDIAN_MODE": "exact",
+    "PARSER": "fast",
+    "CACHE_DIR": None,
+    "URL_NORMALIZERS": [],
+    "MAX_URLS": 0,
+    "METRICS_FILE": None,
+    "LOG_INDEX": None,
+    "REPORT_INTERVAL": 60,
+    "POLL_INTERVAL": 1,
+    "AGG_BACKEND": "python"
 }
 
+MEDIAN_EXACT = 'exact'
+MEDIAN_APPROX = 'approx'
+BACKEND_PYTHON = 'python'
+BACKEND_NUMPY = 'numpy'
+OTHER_URL = 'other'
+TIME_SCALE = 10 ** 6
+CACHE_VERSION = 4
+# по crc последних байт перед offset видно, что уже разобранная часть файла не переписана
+CACHE_CHECK_SIZE = 4096
+
+
+class QuantileSketch:
+    # логарифмические корзины (как в DDSketch): относительная ошибка квантиля не больше ALPHA,
+    # число корзин ограничено диапазоном значений, скетчи складываются без потери точности
+    __slots__ = ('bins', 'count', 'zeros')
+    ALPHA = 0.01
+    GAMMA = (1 + ALPHA) / (1 - ALPHA)
+    LOG_GAMMA = math.log(GAMMA)
+    MIN_VALUE = 1e-9
+
+    def __init__(self):
+        self.bins = {}
+        self.count = 0
+        self.zeros = 0
+
+    def append(self, value):
+        self.count += 1
+        if value <= self.MIN_VALUE:
+            self.zeros += 1
+            return
+        key = math.ceil(math.log(value) / self.LOG_GAMMA)
+        self.bins[key] = self.bins.get(key, 0) + 1
+
+    def extend(self, other):
+        self.count += other.count
+        self.zeros += other.zeros
+        for key, n in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + n
+
+    def to_state(self):
+        return self.bins, self.count, self.zeros
+
+    @classmethod
+    def from_state(cls, state):
+        sketch = cls()
+        sketch.bins, sketch.count, sketch.zeros = state
+        return sketch
+
+    def value_at(self, rank):
+        # оценка значения с номером rank в отсортированной выборке
+        if rank < self.zeros:
+            return 0.
+        seen = self.zeros
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return 2 * self.GAMMA ** key / (self.GAMMA + 1)
+        return 2 * self.GAMMA ** max(self.bins) / (self.GAMMA + 1)
+
+    def quantile(self, q):
+        # как statistics.median для q=0.5: между двумя соседними рангами значение интерполируется
+        if not self.count:
+            raise ValueError('Пустой скетч')
+        rank = q * (self.count - 1)
+        low = math.floor(rank)
+        value = self.value_at(low)
+        if rank > low:
+            value += (self.value_at(low + 1) - value) * (rank - low)
+        return value
+
+
+class UrlStat:
+    # время суммируется целыми микросекундами: сумма не зависит от порядка сложения,
+    # поэтому разбор чанками и слияние дают ровно то же, что последовательный разбор
+    # time_med - посчитанная заранее медиана (group_times), сбрасывается при изменении
+    __slots__ = ('count', 'time_total', 'time_max', 'times', 'time_med')
+
+    def __init__(self, median_mode=MEDIAN_EXACT):
+        self.count = 0
+        self.time_total = 0
+        self.time_max = 0.
+        self.times = QuantileSketch() if median_mode == MEDIAN_APPROX else array('d')
+        self.time_med = None
+
+    @property
+    def time_sum(self):
+        return self.time_total / TIME_SCALE
+
+    def add(self, request_time):
+        self.count += 1
+        self.time_total += round(request_time * TIME_SCALE)
+        if request_time > self.time_max:
+            self.time_max = request_time
+        self.times.append(request_time)
+        self.time_med = None
+
+    def merge(self, other):
+        self.count += other.count
+        self.time_total += other.time_total
+        if other.time_max > self.time_max:
+            self.time_max = other.time_max
+        self.times.extend(other.times)
+        self.time_med = None
+
+    def median(self):
+        if self.time_med is None:
+            if isinstance(self.times, QuantileSketch):
+                self.time_med = self.times.quantile(0.5)
+            else:
+                self.time_med = median(self.times)
+        return self.time_med
+
+    def to_state(self):
+        # в кэш пишутся только встроенные типы, чтобы он читался и из скрипта, и при импорте модуля
+        times = self.times.to_state() if isinstance(self.times, QuantileSketch) else self.times
+        return self.count, self.time_total, self.time_max, times
+
+    @classmethod
+    def from_state(cls, state, median_mode=MEDIAN_EXACT):
+        url_stat = cls.__new__(cls)
+        url_stat.count, url_stat.time_total, url_stat.time_max, times = state
+        url_stat.times = QuantileSketch.from_state(times) if median_mode == MEDIAN_APPROX else times
+        url_stat.time_med = None
+        return url_stat
+
+
+def merge_stats(dict_url, other, max_urls=0):
+    for url, url_stat in other.items():
+        if max_urls and url not in dict_url and len(dict_url) >= max_urls:
+            url = OTHER_URL
+        if url in dict_url:
+            dict_url[url].merge(url_stat)
+        else:
+            dict_url[url] = url_stat
+    return dict_url
+
+
+class Metrics:
+    def __init__(self):
+        self.stages = {}
+        self.lines = 0
+        self.errors = 0
+        self.bytes = 0
+        self.cached_lines = 0
+        self.cached_errors = 0
+        self.cached_bytes = 0
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.) + time.perf_counter() - start
+
+    def count(self, lines=0, errors=0, n_bytes=0, cached_lines=0, cached_errors=0, cached_bytes=0):
+        # lines/errors/bytes - разобранное в этом запуске (bytes - распакованный текст),
+        # cached_* - взятое из кэша
+        self.lines += lines
+        self.errors += errors
+        self.bytes += n_bytes
+        self.cached_lines += cached_lines
+        self.cached_errors += cached_errors
+        self.cached_bytes += cached_bytes
+
+    def as_dict(self):
+        parse_time = self.stages.get('parse')
+        return {
+            'stages': {name: round(elapsed, 6) for name, elapsed in self.stages.items()},
+            'lines': self.lines,
+            'errors': self.errors,
+            'bytes': self.bytes,
+            'cached_lines': self.cached_lines,
+            'cached_errors': self.cached_errors,
+            'cached_bytes': self.cached_bytes,
+            'error_rate': round(self.errors / self.lines, 6) if self.lines else None,
+            'lines_per_sec': round(self.lines / parse_time) if parse_time else None,
+            'bytes_per_sec': round(self.bytes / parse_time) if parse_time else None,
+            'peak_rss_kb': get_peak_rss(),
+        }
+
+
+def get_peak_rss():
+    # ru_maxrss в Linux в килобайтах; воркеры пула учитываются через RUSAGE_CHILDREN
+    if resource is None:
+        return None
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def write_metrics(metrics, metrics_path=None):
+    metrics_json = json.dumps(metrics.as_dict())
+    logging.info("Metrics: {}".format(metrics_json))
+    if metrics_path:
+        with open(metrics_path, mode='w') as f:
+            f.write(metrics_json)
+
+
+def parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError('Дата должна быть в формате YYYY-MM-DD: {}'.format(value))
+
 
 def process_args():
     logging.info('Reading parameter config')
     parser = argparse.ArgumentParser()
     parser.add_argument("--config", dest="config_path")
+    parser.add_argument("--from", dest="date_from", type=parse_date)
+    parser.add_argument("--to", dest="date_to", type=parse_date)
+    parser.add_argument("--profile", dest="profile_path", nargs='?', const='log_analyzer.prof')
+    parser.add_argument("--watch", action='store_true')
     args = parser.parse_args()
     if not args.config_path:
         raise argparse.ArgumentError()
@@ -63,21 +325,85 @@ def combine_config(path_to_config_file, local_config=LOCAL_CONFIG):
         return local_config
 
 
-def get_latest_log_file(path_to_dir):
+def load_log_index(index_path):
+    try:
+        with open(index_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.info("Индекс логов {} не прочитан: {}".format(index_path, e))
+        return None
+
+
+def save_log_index(index_path, index):
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, mode='w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+
+
+def scan_log_dir(path_to_dir, index_path=None):
+    # имя файла -> дата строкой YYYYMMDD; строки такого вида сравниваются так же, как даты.
+    # Пока mtime каталога не изменился, список берется из индекса без чтения каталога,
+    # поэтому сам индекс нужно держать вне LOG_DIR
+    dir_path = os.path.abspath(path_to_dir)
+    dir_mtime = os.stat(path_to_dir).st_mtime_ns
+    index = load_log_index(index_path) if index_path else None
+    if index is None or index.get('dir') != dir_path:
+        index = {'dir': dir_path, 'mtime_ns': None, 'files': {}}
+    if index['mtime_ns'] == dir_mtime:
+        return index['files']
+
+    known = index['files']
+    files = {}
+    with os.scandir(path_to_dir) as entries:
+        for entry in entries:
+            file_name = entry.name
+            if file_name in known:
+                files[file_name] = known[file_name]
+                continue
+            if not file_name.startswith(LOG_NAME_PREFIX):
+                continue
+            match = LOG_NAME_PATTERN.match(file_name)
+            if match:
+                files[file_name] = match.group(1)
+    if index_path:
+        save_log_index(index_path, {'dir': dir_path, 'mtime_ns': dir_mtime, 'files': files})
+    return files
+
+
+def make_file_log(path_to_dir, file_name, file_date):
+    return FILE_LOG(name=file_name, date=datetime.datetime.strptime(file_date, "%Y%m%d").date(),
+                    ext='.gz' if file_name.endswith('.gz') else None,
+                    path_to_file=os.path.join(path_to_dir, file_name))
+
+
+def get_latest_log_file(path_to_dir, index_path=None):
     logging.info('Starting to search latest file')
-    pattern = re.compile(r"^nginx-access-ui\.log-(\d{8})(\.gz)?$")
-    min_date = datetime.datetime.min.date()
-    file_output = None
-    for file_name in os.listdir(path_to_dir):
-        match = pattern.search(file_name)
-        if match:
-            file_date = datetime.datetime.strptime(match.group(1), "%Y%m%d").date()
-            file_ext = match.group(2)
-            if file_date > min_date:
-                min_date = file_date
-                file_output = FILE_LOG(name=file_name, date=file_date, ext=file_ext,
-                                       path_to_file = os.path.join(path_to_dir, file_name))
-    return file_output
+    latest_date = ''
+    latest_name = None
+    for file_name, file_date in scan_log_dir(path_to_dir, index_path).items():
+        if file_date > latest_date:
+            latest_date = file_date
+            latest_name = file_name
+    if latest_name is None:
+        return None
+    return make_file_log(path_to_dir, latest_name, latest_date)
+
+
+def get_log_files(path_to_dir, date_from=None, date_to=None, index_path=None):
+    logging.info('Searching log files from {} to {}'.format(date_from, date_to))
+    date_from = date_from.strftime("%Y%m%d") if date_from else ''
+    date_to = date_to.strftime("%Y%m%d") if date_to else '99999999'
+    names_by_date = {}
+    for file_name, file_date in scan_log_dir(path_to_dir, index_path).items():
+        if not date_from <= file_date <= date_to:
+            continue
+        # если за день есть и .gz, и несжатый файл, берем несжатый: его можно дочитывать
+        if file_date not in names_by_date or not file_name.endswith('.gz'):
+            names_by_date[file_date] = file_name
+    return [make_file_log(path_to_dir, names_by_date[file_date], file_date) for file_date in sorted(names_by_date)]
 
 def process_line(line):
     match = LOG_PATTERN.match(line)
@@ -86,84 +412,757 @@ def process_line(line):
     return None
 
 
-def read_file(file_log, error_percent):
-    logging.info("Обработка файла {}".format(file_log.name))
-    if file_log.ext == '.gz':
-        f = gzip.open(file_log.path_to_file, mode='rt')
+def parse_line_regex(line):
+    res_dict = process_line(line)
+    if res_dict is None:
+        return None
+    request = res_dict['request'].split()
+    url = request[1] if len(request) > 1 else None
+    return url, float(res_dict['request_time'])
+
+
+def parse_line_fast(line):
+    match = LOG_PATTERN_FAST.match(line) or LOG_PATTERN.match(line)
+    if match is None:
+        return None
+    request, request_time = match.group('request', 'request_time')
+    request = request.split(None, 2)
+    url = request[1] if len(request) > 1 else None
+    return url, float(request_time)
+
+
+def decode_url(request):
+    request = request.split(None, 2)
+    return request[1].decode('utf-8', 'replace') if len(request) > 1 else None
+
+
+def parse_line_regex_bytes(line):
+    match = LOG_PATTERN_BYTES.match(line)
+    if match is None:
+        return None
+    return decode_url(match.group('request')), float(match.group('request_time'))
+
+
+def parse_line_fast_bytes(line):
+    # то же, что parse_line_fast, но на байтах: в str декодируется только url
+    match = LOG_PATTERN_FAST_BYTES.match(line) or LOG_PATTERN_BYTES.match(line)
+    if match is None:
+        return None
+    request, request_time = match.group('request', 'request_time')
+    return decode_url(request), float(request_time)
+
+
+PARSERS = {
+    'regex': parse_line_regex,
+    'fast': parse_line_fast,
+}
+
+BYTES_PARSERS = {
+    'regex': parse_line_regex_bytes,
+    'fast': parse_line_fast_bytes,
+}
+
+UUID_SEGMENT = re.compile(r'(?<=/)[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}(?=/|$)')
+NUMERIC_SEGMENT = re.compile(r'(?<=/)\d+(?=/|$)')
+
+
+def strip_query(url):
+    return url.split('?', 1)[0].split('#', 1)[0]
+
+
+def collapse_ids(url):
+    if '-' in url:
+        url = UUID_SEGMENT.sub('{uuid}', url)
+    return NUMERIC_SEGMENT.sub('{id}', url)
+
+
+URL_NORMALIZERS = {
+    'strip_query': strip_query,
+    'collapse_ids': collapse_ids,
+}
+
+PARSE_OPTIONS = namedtuple('PARSE_OPTIONS', ['median_mode', 'parser', 'normalizers', 'max_urls', 'backend'])
+DEFAULT_OPTIONS = PARSE_OPTIONS(median_mode=MEDIAN_EXACT, parser='fast', normalizers=(), max_urls=0,
+                                backend=BACKEND_PYTHON)
+
+# разобрано в этом запуске и взято из кэша: для метрик скорости считается только первое
+PARSE_COUNTS = namedtuple('PARSE_COUNTS', ['lines', 'errors', 'n_bytes', 'cached_lines', 'cached_errors',
+                                           'cached_bytes'])
+
+
+def get_parse_options(config):
+    if config['MEDIAN_MODE'] not in (MEDIAN_EXACT, MEDIAN_APPROX):
+        raise ValueError('Неизвестный режим медианы {}'.format(config['MEDIAN_MODE']))
+    if config['PARSER'] not in PARSERS:
+        raise ValueError('Неизвестный парсер {}'.format(config['PARSER']))
+    for name in config['URL_NORMALIZERS']:
+        if name not in URL_NORMALIZERS:
+            raise ValueError('Неизвестная нормализация url {}'.format(name))
+    backend = config['AGG_BACKEND']
+    if backend not in (BACKEND_PYTHON, BACKEND_NUMPY):
+        raise ValueError('Неизвестный бэкенд агрегации {}'.format(backend))
+    if backend == BACKEND_NUMPY and np is None:
+        logging.info('numpy не установлен, агрегация на чистом Python')
+        backend = BACKEND_PYTHON
+    return PARSE_OPTIONS(median_mode=config['MEDIAN_MODE'], parser=config['PARSER'],
+                         normalizers=tuple(config['URL_NORMALIZERS']), max_urls=config['MAX_URLS'] or 0,
+                         backend=backend)
+
+
+def parse_lines(lines, options=DEFAULT_OPTIONS, dict_url=None, parsers=PARSERS):
+    if options.backend == BACKEND_NUMPY:
+        return parse_lines_numpy(lines, options, dict_url, parsers)
+    n_lines = 0
+    n_errors = 0
+    if dict_url is None:
+        dict_url = {}
+    parse_line = parsers[options.parser]
+    normalizers = [URL_NORMALIZERS[name] for name in options.normalizers]
+    max_urls = options.max_urls
+    for line in lines:
+        n_lines += 1
+        res = parse_line(line)
+        if res is None:
+            n_errors += 1
+            continue
+        url, request_time = res
+        if url is None:
+            continue
+        for normalize in normalizers:
+            url = normalize(url)
+        url_stat = dict_url.get(url)
+        if url_stat is None:
+            # после MAX_URLS различных url все новые попадают в общую корзину
+            if max_urls and len(dict_url) >= max_urls:
+                url = OTHER_URL
+                url_stat = dict_url.get(url)
+            if url_stat is None:
+                url_stat = dict_url[url] = UrlStat(options.median_mode)
+        url_stat.add(request_time)
+    return dict_url, n_lines, n_errors
+
+
+def parse_lines_numpy(lines, options=DEFAULT_OPTIONS, dict_url=None, parsers=PARSERS):
+    # url кодируются целыми id, времена копятся в одном непрерывном массиве,
+    # а count/sum/max по группам считаются в numpy после разбора
+    n_lines = 0
+    n_errors = 0
+    if dict_url is None:
+        dict_url = {}
+    parse_line = parsers[options.parser]
+    normalizers = [URL_NORMALIZERS[name] for name in options.normalizers]
+    max_urls = options.max_urls
+    # уже накопленные url получают первые id, чтобы MAX_URLS считался так же, как в parse_lines
+    url_ids = {url: url_id for url_id, url in enumerate(dict_url)}
+    ids = array('q')
+    times = array('d')
+    for line in lines:
+        n_lines += 1
+        res = parse_line(line)
+        if res is None:
+            n_errors += 1
+            continue
+        url, request_time = res
+        if url is None:
+            continue
+        for normalize in normalizers:
+            url = normalize(url)
+        url_id = url_ids.get(url)
+        if url_id is None:
+            if max_urls and len(url_ids) >= max_urls:
+                url = OTHER_URL
+                url_id = url_ids.get(url)
+            if url_id is None:
+                url_id = url_ids[url] = len(url_ids)
+        ids.append(url_id)
+        times.append(request_time)
+    merge_stats(dict_url, group_times(list(url_ids), ids, times, options.median_mode))
+    return dict_url, n_lines, n_errors
+
+
+def group_times(urls, ids, times, median_mode=MEDIAN_EXACT):
+    if not len(ids):
+        return {}
+    ids = np.frombuffer(ids, dtype=np.int64)
+    times = np.frombuffer(times, dtype=np.float64)
+    # одна сортировка по (id, time): группы идут подряд, внутри группы времена по возрастанию,
+    # поэтому max - последний элемент группы, медиана - средний, а суммы - разности cumsum
+    # то же, что np.lexsort((times, ids)), но быстрее: быстрая сортировка по времени, затем устойчивая по id
+    order = np.argsort(times)
+    order = order[np.argsort(ids[order], kind='stable')]
+    sorted_ids = ids[order]
+    sorted_times = times[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_ids[1:] != sorted_ids[:-1])))
+    ends = np.append(starts[1:], len(sorted_ids))
+    counts = ends - starts
+    # как UrlStat.add: целые микросекунды, сумма в int64 точная
+    totals = np.concatenate(([0], np.cumsum(np.rint(sorted_times * TIME_SCALE).astype(np.int64))))
+    group_totals = totals[ends] - totals[starts]
+    maxs = sorted_times[ends - 1]
+    group_ids = sorted_ids[starts]
+    if median_mode == MEDIAN_APPROX:
+        states = sketch_states(sorted_ids, sorted_times, group_ids, counts)
+        medians = [None] * len(starts)
     else:
-        f = file_log.path_to_file.open()
+        # как statistics.median: средний элемент или полусумма двух средних
+        medians = ((sorted_times[starts + (counts - 1) // 2] + sorted_times[starts + counts // 2]) / 2).tolist()
+        buffer = sorted_times.tobytes()
+        item_size = sorted_times.itemsize
+        states = [array('d', buffer[start * item_size:end * item_size])
+                  for start, end in zip(starts.tolist(), ends.tolist())]
+    dict_url = {}
+    for url_id, count, time_total, time_max, group_times_state, time_med in zip(
+            group_ids.tolist(), counts.tolist(), group_totals.tolist(), maxs.tolist(), states, medians):
+        url_stat = UrlStat.from_state((count, time_total, time_max, group_times_state), median_mode)
+        url_stat.time_med = time_med
+        dict_url[urls[url_id]] = url_stat
+    return dict_url
+
+
+def sketch_states(sorted_ids, sorted_times, group_ids, counts):
+    # корзины QuantileSketch для всех групп сразу: внутри группы времена отсортированы,
+    # поэтому одинаковые ключи корзин идут подряд
+    positive = sorted_times > QuantileSketch.MIN_VALUE
+    bin_ids = sorted_ids[positive]
+    keys = np.ceil(np.log(sorted_times[positive]) / QuantileSketch.LOG_GAMMA).astype(np.int64)
+    run_starts = np.flatnonzero(np.concatenate(([True], (bin_ids[1:] != bin_ids[:-1]) | (keys[1:] != keys[:-1]))))
+    run_counts = np.diff(np.append(run_starts, len(keys))).tolist()
+    run_ids = bin_ids[run_starts]
+    run_keys = keys[run_starts].tolist()
+    bounds = np.searchsorted(run_ids, group_ids).tolist() + [len(run_keys)]
+    positives = np.bincount(bin_ids, minlength=int(group_ids[-1]) + 1)[group_ids]
+    return [(dict(zip(run_keys[start:end], run_counts[start:end])), count, zeros)
+            for start, end, count, zeros in zip(bounds, bounds[1:], counts.tolist(), (counts - positives).tolist())]
+
+
+def split_chunks(path_to_file, n_chunks, start=0, end=None):
+    # границы чанков сдвигаются к началу следующей строки
+    if end is None:
+        end = os.path.getsize(path_to_file)
+    size = end - start
+    bounds = [start]
+    with open(path_to_file, 'rb') as f:
+        for i in range(1, n_chunks):
+            f.seek(max(start + size * i // n_chunks, bounds[-1] + 1) - 1)
+            f.readline()
+            bounds.append(min(f.tell(), end))
+    bounds.append(end)
+    return [(chunk_start, chunk_end) for chunk_start, chunk_end in zip(bounds, bounds[1:])
+            if chunk_end > chunk_start]
+
+
+def read_chunk_lines(path_to_file, start, end):
+    # файл отображается в память: процессы-чанки читают одни и те же страницы кэша,
+    # а строки остаются байтами, в str потом декодируется только url
+    if end <= start:
+        return
+    with open(path_to_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        end = min(end, len(mm))
+        pos = start
+        while pos < end:
+            line_end = mm.find(b'\n', pos, end)
+            if line_end < 0:
+                line_end = end
+            yield mm[pos:line_end]
+            pos = line_end + 1
+
+
+def parse_chunk(path_to_file, start, end, options, dict_url=None):
+    return parse_lines(read_chunk_lines(path_to_file, start, end), options, dict_url, parsers=BYTES_PARSERS)
+
+
+def parse_range(path_to_file, start, end, workers=1, options=DEFAULT_OPTIONS, dict_url=None):
+    if dict_url is None:
+        dict_url = {}
+    if workers <= 1:
+        return parse_chunk(path_to_file, start, end, options, dict_url)
+    chunks = split_chunks(path_to_file, workers, start, end)
+    logging.info("Разбор {} в {} процессах, чанков: {}".format(path_to_file, workers, len(chunks)))
+    # чанки разбираются без MAX_URLS: ограничение применяется при слиянии, иначе чанк
+    # мог бы отправить в other url, который при последовательном разборе попал бы в отчет
+    chunk_options = options._replace(max_urls=0)
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.starmap(parse_chunk, [(path_to_file, chunk_start, chunk_end, chunk_options)
+                                             for chunk_start, chunk_end in chunks])
     n_lines = 0
     n_errors = 0
-    dict_url = defaultdict(list)
-    with f:
-        for line in f:
-            n_lines += 1
-            res_dict = process_line(line)
-            if res_dict is None:
-                n_errors += 1
-                continue
-            try:
-                url = res_dict['request'].split()[1]
-                dict_url[url].append(float(res_dict['request_time']))
-            except(ValueError, TypeError, IndexError):
-                continue
-    if n_errors/n_lines > error_percent:
+    # чанки идут по порядку, поэтому списки времен совпадают с последовательным разбором
+    for chunk_dict_url, chunk_lines, chunk_errors in results:
+        merge_stats(dict_url, chunk_dict_url, options.max_urls)
+        n_lines += chunk_lines
+        n_errors += chunk_errors
+    return dict_url, n_lines, n_errors
+
+
+def get_last_line_end(path_to_file, start, end):
+    # конец последней полной строки: недописанный хвост активного файла в кэш не попадает
+    block_size = 64 * 1024
+    with open(path_to_file, 'rb') as f:
+        pos = end
+        while pos > start:
+            block_start = max(pos - block_size, start)
+            f.seek(block_start)
+            idx = f.read(pos - block_start).rfind(b'\n')
+            if idx >= 0:
+                return block_start + idx + 1
+            pos = block_start
+    return start
+
+
+def read_gzip_blocks(path_to_file, block_size=GZIP_BLOCK_SIZE):
+    with gzip.open(path_to_file, mode='rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                return
+            yield block
+
+
+def read_blocks_in_thread(blocks, queue_size=4):
+    # zlib отпускает GIL, поэтому распаковка в потоке идет параллельно с разбором строк
+    blocks_queue = queue.Queue(maxsize=queue_size)
+    done = object()
+    errors = []
+
+    def produce():
+        try:
+            for block in blocks:
+                blocks_queue.put(block)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            blocks_queue.put(done)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    while True:
+        block = blocks_queue.get()
+        if block is done:
+            break
+        yield block
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def split_block_lines(blocks):
+    rest = b''
+    for block in blocks:
+        lines = (rest + block).split(b'\n')
+        rest = lines.pop()
+        yield from lines
+    if rest:
+        yield rest
+
+
+def parse_gzip(path_to_file, options=DEFAULT_OPTIONS, threaded=False):
+    # кроме агрегатов возвращает размер распакованного текста
+    n_bytes = 0
+
+    def count_blocks(blocks):
+        nonlocal n_bytes
+        for block in blocks:
+            n_bytes += len(block)
+            yield block
+
+    blocks = count_blocks(read_gzip_blocks(path_to_file))
+    if threaded:
+        blocks = read_blocks_in_thread(blocks)
+    dict_url, n_lines, n_errors = parse_lines(split_block_lines(blocks), options, parsers=BYTES_PARSERS)
+    return dict_url, n_lines, n_errors, n_bytes
+
+
+def parse_file(file_log, workers=1, options=DEFAULT_OPTIONS):
+    if file_log.ext == '.gz':
+        # gzip не делится на чанки, поэтому при WORKERS > 1 распаковка уходит в отдельный поток
+        return parse_gzip(file_log.path_to_file, options, threaded=workers > 1)
+    size = os.path.getsize(file_log.path_to_file)
+    return parse_range(file_log.path_to_file, 0, size, workers, options) + (size,)
+
+
+def get_cache_path(cache_dir, file_log):
+    return os.path.join(cache_dir, file_log.name + '.cache')
+
+
+def load_cache(cache_path):
+    try:
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError) as e:
+        logging.info("Кэш {} не прочитан: {}".format(cache_path, e))
+        return None
+
+
+def save_cache(cache_path, entry):
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+
+
+def get_offset_crc(path_to_file, offset):
+    start = max(offset - CACHE_CHECK_SIZE, 0)
+    with open(path_to_file, 'rb') as f:
+        f.seek(start)
+        return zlib.crc32(f.read(offset - start))
+
+
+def can_resume(path_to_file, entry, file_stat):
+    # файл только дописывается: тот же inode, не короче и не старше сохраненного,
+    # а байты перед смещением не изменились (файл не обрезали и не переписали на месте)
+    if entry['inode'] != file_stat.st_ino or not 0 < entry['offset'] <= file_stat.st_size:
+        return False
+    if file_stat.st_size < entry['size'] or file_stat.st_mtime < entry['mtime']:
+        return False
+    return get_offset_crc(path_to_file, entry['offset']) == entry['offset_crc']
+
+
+def read_file_cached(file_log, cache_dir, workers=1, options=DEFAULT_OPTIONS):
+    path_to_file = file_log.path_to_file
+    cache_path = get_cache_path(cache_dir, file_log)
+    file_stat = os.stat(path_to_file)
+    entry = load_cache(cache_path)
+    if entry is not None and (entry.get('version') != CACHE_VERSION or entry['options'] != tuple(options)):
+        entry = None
+    # агрегаты покрывают файл только до offset: если последняя строка без перевода строки,
+    # она не сохранена в кэше и ее надо дочитать, иначе при втором запуске она потеряется
+    if (entry is not None and entry['offset'] == entry['size'] == file_stat.st_size
+            and entry['mtime'] == file_stat.st_mtime):
+        logging.info("Агрегаты {} взяты из кэша".format(file_log.name))
+        dict_url = {url: UrlStat.from_state(state, options.median_mode) for url, state in entry['stats'].items()}
+        return dict_url, PARSE_COUNTS(0, 0, 0, entry['n_lines'], entry['n_errors'], entry['n_bytes'])
+
+    cached = PARSE_COUNTS(0, 0, 0, 0, 0, 0)
+    if file_log.ext == '.gz':
+        dict_url, n_lines, n_errors, n_bytes = parse_file(file_log, workers, options)
+        offset = file_stat.st_size
+        tail = False
+    else:
+        offset = get_last_line_end(path_to_file, 0, file_stat.st_size)
+        if entry is not None and can_resume(path_to_file, entry, file_stat):
+            logging.info("Дочитываем {} со смещения {}".format(file_log.name, entry['offset']))
+            dict_url = {url: UrlStat.from_state(state, options.median_mode) for url, state in entry['stats'].items()}
+            offset = max(offset, entry['offset'])
+            dict_url, new_lines, new_errors = parse_range(path_to_file, entry['offset'], offset, workers, options,
+                                                          dict_url)
+            n_lines = entry['n_lines'] + new_lines
+            n_errors = entry['n_errors'] + new_errors
+            cached = PARSE_COUNTS(0, 0, 0, entry['n_lines'], entry['n_errors'], entry['offset'])
+        else:
+            dict_url, n_lines, n_errors = parse_range(path_to_file, 0, offset, workers, options)
+        n_bytes = offset
+        tail = offset < file_stat.st_size
+
+    save_cache(cache_path, {
+        'version': CACHE_VERSION,
+        'size': file_stat.st_size,
+        'mtime': file_stat.st_mtime,
+        'inode': file_stat.st_ino,
+        'offset': offset,
+        'offset_crc': get_offset_crc(path_to_file, offset),
+        'options': tuple(options),
+        'stats': {url: url_stat.to_state() for url, url_stat in dict_url.items()},
+        'n_lines': n_lines,
+        'n_errors': n_errors,
+        'n_bytes': n_bytes,
+    })
+    if tail:
+        dict_url, tail_lines, tail_errors = parse_range(path_to_file, offset, file_stat.st_size,
+                                                        options=options, dict_url=dict_url)
+        n_lines += tail_lines
+        n_errors += tail_errors
+        n_bytes = file_stat.st_size
+    return dict_url, cached._replace(lines=n_lines - cached.cached_lines, errors=n_errors - cached.cached_errors,
+                                     n_bytes=n_bytes - cached.cached_bytes)
+
+
+def load_file(file_log, error_percent, workers=1, options=DEFAULT_OPTIONS, cache_dir=None):
+    logging.info("Обработка файла {}".format(file_log.name))
+    if cache_dir:
+        dict_url, counts = read_file_cached(file_log, cache_dir, workers, options)
+    else:
+        dict_url, n_lines, n_errors, n_bytes = parse_file(file_log, workers, options)
+        counts = PARSE_COUNTS(n_lines, n_errors, n_bytes, 0, 0, 0)
+    n_lines = counts.lines + counts.cached_lines
+    n_errors = counts.errors + counts.cached_errors
+    if n_lines and n_errors/n_lines > error_percent:
         raise Exception("Доля ошибок превысила допустимый пределел {}".format(error_percent))
+    return dict_url, counts
+
+
+def read_file(file_log, error_percent, workers=1, options=DEFAULT_OPTIONS, cache_dir=None, metrics=None):
+    dict_url, counts = load_file(file_log, error_percent, workers, options, cache_dir)
+    if metrics is not None:
+        metrics.count(*counts)
+    return dict_url
+
+
+def read_files(file_logs, error_percent, workers=1, options=DEFAULT_OPTIONS, cache_dir=None, metrics=None):
+    if len(file_logs) == 1:
+        return read_file(file_logs[0], error_percent, workers, options, cache_dir, metrics)
+    args = [(file_log, error_percent, 1, options, cache_dir) for file_log in file_logs]
+    if workers > 1:
+        with multiprocessing.Pool(min(workers, len(file_logs))) as pool:
+            results = pool.starmap(load_file, args)
+    else:
+        results = [load_file(*file_args) for file_args in args]
+    dict_url = {}
+    for file_dict_url, counts in results:
+        merge_stats(dict_url, file_dict_url, options.max_urls)
+        if metrics is not None:
+            metrics.count(*counts)
     return dict_url
 
+
+def get_stat_row(url, url_stat, total_count, total_times):
+    return {
+        'url': url,
+        'count': url_stat.count,
+        'count_perc': round(100. * url_stat.count / float(total_count), 3),
+        'time_sum': round(url_stat.time_sum, 3),
+        'time_perc': round(100. * url_stat.time_sum / total_times, 3),
+        'time_avg': round(url_stat.time_sum / url_stat.count, 3),
+        'time_max': round(url_stat.time_max, 3),
+        "time_med": round(url_stat.median(), 3),
+    }
+
+
 def compute_stat(dict_url, report_size):
     total_times = 0
     total_count = 0
-    for _, v in dict_url.items():
-        total_times += sum(v)
-        total_count += len(v)
-
-    stat = []
-    for url, request_times in dict_url.items():
-        stat.append({
-            'url': url,
-            'count': len(request_times),
-            'count_perc': round(100. * len(request_times) / float(total_count), 3),
-            'time_sum': round(sum(request_times), 3),
-            'time_perc': round(100. * sum(request_times) / total_times, 3),
-            'time_avg': round(sum(request_times)/len(request_times), 3),
-            'time_max': round(max(request_times), 3),
-            "time_med": round(median(request_times), 3),
-        })
-    stat = sorted(stat, key = lambda x: x['time_sum'], reverse=True)
-    stat = stat[:report_size]
-    return stat
+    for url_stat in dict_url.values():
+        total_times += url_stat.time_total
+        total_count += url_stat.count
+    total_times /= TIME_SCALE
+
+    # nlargest эквивалентен sorted(..., reverse=True)[:n], включая порядок при равных time_sum,
+    # поэтому медианы и проценты считаются только для попавших в отчет url
+    top = heapq.nlargest(report_size, dict_url.items(), key=lambda item: round(item[1].time_sum, 3))
+    return [get_stat_row(url, url_stat, total_count, total_times) for url, url_stat in top]
 
 def get_report_path(report_dir, file_log):
     report_name = 'report-{}.html'.format(file_log.date.strftime(format='%Y.%m.%d'))
     report_path = os.path.join(report_dir, report_name)
     return report_path
 
+
+def get_range_report_path(report_dir, date_from, date_to):
+    report_name = 'report-{}-{}.html'.format(date_from.strftime(format='%Y.%m.%d'),
+                                             date_to.strftime(format='%Y.%m.%d'))
+    return os.path.join(report_dir, report_name)
+
+def split_template(template):
+    # делит шаблон по $table_json так же, как его разбирает string.Template.safe_substitute:
+    # $$ превращается в $, остальные плейсхолдеры остаются как есть
+    parts = []
+    chunk = []
+    pos = 0
+    for match in string.Template.pattern.finditer(template):
+        chunk.append(template[pos:match.start()])
+        if (match.group('named') or match.group('braced')) == 'table_json':
+            parts.append(''.join(chunk))
+            chunk = []
+        elif match.group('escaped') is not None:
+            chunk.append('$')
+        else:
+            chunk.append(match.group())
+        pos = match.end()
+    chunk.append(template[pos:])
+    parts.append(''.join(chunk))
+    return parts
+
+
+@functools.lru_cache(maxsize=8)
+def load_template(template_path, mtime_ns):
+    with open(template_path) as f:
+        return tuple(split_template(f.read()))
+
+
+def write_table_json(f, stat):
+    # построчно пишет то же, что json.dumps(stat), не собирая весь документ в одну строку
+    f.write('[')
+    for i, row in enumerate(stat):
+        if i:
+            f.write(', ')
+        f.write(json.dumps(row))
+    f.write(']')
+
+
+def get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
 def create_report(report_dir, report_path, stat):
     template_path = os.path.join(report_dir, 'report.html')
-    with open(template_path) as f:
-        template = string.Template(f.read())
-    report = template.safe_substitute(table_json=json.dumps(stat))
-    with open(report_path, mode='w') as f:
-        f.write(report)
+    parts = load_template(template_path, os.stat(template_path).st_mtime_ns)
+    # пишем во временный файл рядом с отчетом и переименовываем: недописанный отчет не появится
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(report_path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode='w') as f:
+            f.write(parts[0])
+            for part in parts[1:]:
+                write_table_json(f, stat)
+                f.write(part)
+        # mkstemp создает файл с правами 0600, а отчет должен получить обычные права по umask
+        os.chmod(tmp_path, 0o666 & ~get_umask())
+        os.replace(tmp_path, report_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
     logging.info("Отчет {} создан".format(report_path))
 
 
-def main():
-    args = process_args()
-    config = combine_config(path_to_config_file=args.config_path)
-    logging.info("Config is {}".format(config))
-    file_log_latest = get_latest_log_file(config['LOG_DIR'])
+class LogWatcher:
+    # хвост самого свежего лога дочитывается в агрегаты в памяти, отчет за день
+    # перезаписывается раз в REPORT_INTERVAL секунд
+    def __init__(self, config):
+        self.config = config
+        self.options = get_parse_options(config)
+        self.file_log = None
+        self.reset(None)
+
+    def reset(self, file_log):
+        self.file_log = file_log
+        self.inode = None
+        self.offset = 0
+        self.dict_url = {}
+        self.n_lines = 0
+        self.n_errors = 0
+
+    def read_new_lines(self):
+        path_to_file = self.file_log.path_to_file
+        try:
+            file_stat = os.stat(path_to_file)
+        except FileNotFoundError:
+            return
+        if self.inode is not None and (file_stat.st_ino != self.inode or file_stat.st_size < self.offset):
+            logging.info("Файл {} пересоздан или обрезан, читаем заново".format(self.file_log.name))
+            self.reset(self.file_log)
+        self.inode = file_stat.st_ino
+        if self.file_log.ext == '.gz':
+            # сжатый файл уже ротирован и больше не растет: читаем его один раз
+            if not self.offset:
+                self.dict_url, self.n_lines, self.n_errors, _ = parse_file(self.file_log, options=self.options)
+                self.offset = file_stat.st_size
+            return
+        end = get_last_line_end(path_to_file, self.offset, file_stat.st_size)
+        if end <= self.offset:
+            return
+        self.dict_url, n_lines, n_errors = parse_range(path_to_file, self.offset, end, options=self.options,
+                                                       dict_url=self.dict_url)
+        self.offset = end
+        self.n_lines += n_lines
+        self.n_errors += n_errors
+
+    def poll(self):
+        file_log = get_latest_log_file(self.config['LOG_DIR'], self.config['LOG_INDEX'])
+        if file_log is None:
+            return
+        if self.file_log is None or file_log.name != self.file_log.name:
+            if self.file_log is not None:
+                logging.info("Ротация: {} -> {}".format(self.file_log.name, file_log.name))
+                self.read_new_lines()
+                self.write_report()
+            self.reset(file_log)
+        self.read_new_lines()
+
+    def write_report(self):
+        if self.file_log is None or not self.n_lines:
+            return
+        if self.n_errors / self.n_lines > self.config['ERROR_PERCENT']:
+            logging.error("Доля ошибок в {} превысила допустимый предел {}".format(
+                self.file_log.name, self.config['ERROR_PERCENT']))
+            return
+        stat = compute_stat(dict_url=self.dict_url, report_size=self.config['REPORT_SIZE'])
+        report_path = get_report_path(report_dir=self.config['REPORT_DIR'], file_log=self.file_log)
+        create_report(report_dir=self.config['REPORT_DIR'], report_path=report_path, stat=stat)
+
+    def run(self, max_polls=None):
+        last_report = None
+        polls = 0
+        try:
+            while max_polls is None or polls < max_polls:
+                self.poll()
+                polls += 1
+                now = time.monotonic()
+                if last_report is None or now - last_report >= self.config['REPORT_INTERVAL']:
+                    self.write_report()
+                    last_report = now
+                if max_polls is None or polls < max_polls:
+                    time.sleep(self.config['POLL_INTERVAL'])
+        except KeyboardInterrupt:
+            logging.info("Остановка наблюдения")
+        self.write_report()
+
+
+def main_range(config, date_from, date_to, metrics):
+    with metrics.stage('discovery'):
+        file_logs = get_log_files(config['LOG_DIR'], date_from, date_to, config['LOG_INDEX'])
+    logging.info("Log files in range: {}".format([file_log.name for file_log in file_logs]))
+    if not file_logs:
+        raise FileNotFoundError('Нет файлов для обработки')
+    report_path = get_range_report_path(report_dir=config['REPORT_DIR'],
+                                        date_from=date_from or file_logs[0].date,
+                                        date_to=date_to or file_logs[-1].date)
+    if os.path.exists(report_path):
+        logging.info("Отчет {} уже существует".format(report_path))
+        return
+    with metrics.stage('parse'):
+        dict_url_raw = read_files(file_logs, error_percent=config['ERROR_PERCENT'],
+                                  workers=config['WORKERS'], options=get_parse_options(config),
+                                  cache_dir=config['CACHE_DIR'], metrics=metrics)
+    with metrics.stage('aggregate'):
+        stat = compute_stat(dict_url=dict_url_raw, report_size=config['REPORT_SIZE'])
+    with metrics.stage('render'):
+        create_report(report_dir=config['REPORT_DIR'], report_path=report_path, stat=stat)
+
+
+def main_latest(config, metrics):
+    with metrics.stage('discovery'):
+        file_log_latest = get_latest_log_file(config['LOG_DIR'], config['LOG_INDEX'])
     logging.info("Latest log file is {}".format(file_log_latest))
     if not file_log_latest:
         raise FileNotFoundError('Нет файлов для обработки')
-    dict_url_raw = read_file(file_log_latest, error_percent=config['ERROR_PERCENT'])
-    stat = compute_stat(dict_url=dict_url_raw, report_size=config['REPORT_SIZE'])
     report_path = get_report_path(report_dir=config['REPORT_DIR'], file_log=file_log_latest)
     if os.path.exists(report_path):
         logging.info("Отчет {} уже существует".format(report_path))
         return
-    create_report(report_dir=config['REPORT_DIR'], report_path=report_path, stat=stat)
+    with metrics.stage('parse'):
+        dict_url_raw = read_file(file_log_latest, error_percent=config['ERROR_PERCENT'],
+                                 workers=config['WORKERS'], options=get_parse_options(config),
+                                 cache_dir=config['CACHE_DIR'], metrics=metrics)
+    with metrics.stage('aggregate'):
+        stat = compute_stat(dict_url=dict_url_raw, report_size=config['REPORT_SIZE'])
+    with metrics.stage('render'):
+        create_report(report_dir=config['REPORT_DIR'], report_path=report_path, stat=stat)
+
+
+def main():
+    args = process_args()
+    config = combine_config(path_to_config_file=args.config_path)
+    logging.info("Config is {}".format(config))
+    metrics = Metrics()
+    profiler = cProfile.Profile() if args.profile_path else None
+    if profiler:
+        profiler.enable()
+    try:
+        if args.watch:
+            LogWatcher(config).run()
+        elif args.date_from or args.date_to:
+            main_range(config, args.date_from, args.date_to, metrics)
+        else:
+            main_latest(config, metrics)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile_path)
+            logging.info("Профиль сохранен в {}".format(args.profile_path))
+        write_metrics(metrics, config['METRICS_FILE'])
 
 
 if __name__ == "__main__":
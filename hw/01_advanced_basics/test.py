@@ -4,6 +4,51 @@ import unittest
 import sys
 import log_analyzer as la
 import io
+import string
+import json
+import functools
+import os
+import tempfile
+import datetime
+import gzip
+import random
+import unittest.mock
+from array import array
+from statistics import median
+
+LOG_LINE = '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] ' \
+           '"GET {url} HTTP/1.1" 200 927 "-" "Lynx/2.8.8dev.9 ' \
+           'libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" ' \
+           '"1498697422-2190034393-4708-9752759" "dc7161be3" {time}\n'
+
+
+def write_log(dir_name, lines, name='nginx-access-ui.log-20170630'):
+    path = os.path.join(dir_name, name)
+    with open(path, 'w') as f:
+        f.writelines(lines)
+    return la.FILE_LOG(name=name, date=None, ext=None, path_to_file=path)
+
+
+def sample_lines(n):
+    lines = []
+    for i in range(n):
+        if i % 17 == 0:
+            lines.append('broken line\n')
+        else:
+            lines.append(LOG_LINE.format(url='/api/v2/banner/{}'.format(i % 7), time='0.{:03d}'.format(i % 1000)))
+    return lines
+
+
+def cases(cases):
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args):
+            for c in cases:
+                new_args = args + (c if isinstance(c, tuple) else (c,))
+                f(*new_args)
+        return wrapper
+    return decorator
+
 
 class TestConfigPath(unittest.TestCase):
     def test_path(self):
@@ -25,6 +70,471 @@ class TestProcessLog(unittest.TestCase):
         res = la.process_line(valid_string)
         self.assertIsNotNone(res)
 
+    def test_fast_parser_matches_regex(self):
+        lines = sample_lines(100) + [
+            LOG_LINE.format(url='/export/appinstall_raw/2017-06-29/', time='0.001'),
+            LOG_LINE.format(url='/x', time='abc'),
+            LOG_LINE.format(url='/x', time='1'),
+            '1.1.1.1 - - [29/Jun/2017:03:50:22 +0300] "0" 400 166 "-" "-" "-" "-" "-" 0.000\n',
+            LOG_LINE.format(url='/x', time='0.1').replace('1.196.116.32', 'localhost'),
+            ' ' + LOG_LINE.format(url='/x', time='0.1'),
+            LOG_LINE.format(url='/x', time='0.1').replace('[29/Jun/2017:03:50:22 +0300] ', ''),
+            LOG_LINE.format(url='/x', time='0.1').replace('[29/Jun/2017:03:50:22 +0300]', '29/Jun/2017'),
+            LOG_LINE.format(url='/x', time='0.1').replace(' 200 ', ' OK '),
+            LOG_LINE.format(url='/x', time='0.1').replace(' 200 ', ' '),
+            LOG_LINE.format(url='/x', time='0.1').replace(' 200 927 ', '  200 '),
+            LOG_LINE.format(url='/x', time='0.1').replace(' 200 927 ', ' 200  '),
+            LOG_LINE.format(url='/x', time='0.1').replace(' 200 927 ', ' 200 9 7 '),
+            LOG_LINE.format(url='/x', time='0.1').replace('HTTP/1.1" 200', 'HTTP/1.1"200'),
+            LOG_LINE.format(url='/x', time='0.1').replace('"dc7161be3" ', '"dc7161be3"'),
+        ]
+        for line in lines:
+            self.assertEqual(la.parse_line_fast(line), la.parse_line_regex(line), line)
+            self.assertEqual(la.parse_line_fast_bytes(line.encode()), la.parse_line_regex(line), line)
+            self.assertEqual(la.parse_line_regex_bytes(line.encode()), la.parse_line_regex(line), line)
+
+
+class TestReadFile(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.file_log = write_log(self.tmp_dir.name, sample_lines(1000))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_split_chunks_aligned(self):
+        chunks = la.split_chunks(self.file_log.path_to_file, 4)
+        with open(self.file_log.path_to_file, 'rb') as f:
+            data = f.read()
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], len(data))
+        for start, end in chunks:
+            self.assertTrue(start == 0 or data[start - 1:start] == b'\n')
+
+    def test_parallel_matches_serial(self):
+        serial = la.read_file(self.file_log, error_percent=0.4)
+        parallel = la.read_file(self.file_log, error_percent=0.4, workers=3)
+        self.assertEqual(la.compute_stat(serial, 100), la.compute_stat(parallel, 100))
+
+    def test_parallel_sums_are_exact(self):
+        # при сложении float в другом порядке суммы расходятся в последних битах,
+        # на тысячах url этого хватает, чтобы по-другому округлились time_avg/time_sum
+        rnd = random.Random(1)
+        lines = [LOG_LINE.format(url='/api/v2/banner/{}'.format(rnd.randrange(50)),
+                                 time='{:.3f}'.format(rnd.expovariate(5))) for _ in range(20000)]
+        file_log = write_log(self.tmp_dir.name, lines, name='nginx-access-ui.log-20170701')
+        serial = la.read_file(file_log, error_percent=0.4)
+        for workers in (2, 4, 7):
+            parallel = la.read_file(file_log, error_percent=0.4, workers=workers)
+            self.assertEqual({url: (s.count, s.time_sum, s.time_max) for url, s in serial.items()},
+                             {url: (s.count, s.time_sum, s.time_max) for url, s in parallel.items()})
+            self.assertEqual(la.compute_stat(serial, 100), la.compute_stat(parallel, 100))
+
+    def test_gzip_matches_plain(self):
+        gz_path = self.file_log.path_to_file + '.gz'
+        with open(self.file_log.path_to_file, 'rb') as src, gzip.open(gz_path, 'wb') as dst:
+            dst.write(src.read())
+        gz_log = self.file_log._replace(name=self.file_log.name + '.gz', ext='.gz', path_to_file=gz_path)
+        plain = la.compute_stat(la.read_file(self.file_log, error_percent=0.4), 100)
+        for workers in (1, 2):
+            metrics = la.Metrics()
+            self.assertEqual(la.compute_stat(la.read_file(gz_log, error_percent=0.4, workers=workers,
+                                                          metrics=metrics), 100), plain)
+            self.assertEqual(metrics.bytes, os.path.getsize(self.file_log.path_to_file))
+
+    def test_read_chunk_lines(self):
+        path = os.path.join(self.tmp_dir.name, 'lines.log')
+        with open(path, 'wb') as f:
+            f.write(b'first\nsecond\n\nlast')
+        self.assertEqual(list(la.read_chunk_lines(path, 0, 22)), [b'first', b'second', b'', b'last'])
+        self.assertEqual(list(la.read_chunk_lines(path, 6, 14)), [b'second', b''])
+        self.assertEqual(list(la.read_chunk_lines(path, 6, 6)), [])
+
+    def test_split_block_lines(self):
+        blocks = [b'a\nb', b'c\n\nd', b'', b'e\n']
+        self.assertEqual(list(la.split_block_lines(blocks)), [b'a', b'bc', b'', b'de'])
+
+    def test_error_percent(self):
+        with self.assertRaises(Exception):
+            la.read_file(self.file_log, error_percent=0.01, workers=2)
+
+
+class TestUrlNormalization(unittest.TestCase):
+    @cases([
+        ('/api/v2/banner/25019354', '/api/v2/banner/{id}'),
+        ('/api/v2/banner/25019354/?utm=1', '/api/v2/banner/{id}/'),
+        ('/api/1/photo/2f1c6a3e-1b2c-4d5e-8f90-a1b2c3d4e5f6/', '/api/{id}/photo/{uuid}/'),
+        ('/export/appinstall_raw/2017-06-29/', '/export/appinstall_raw/2017-06-29/'),
+        ('/api/v2/group/7786679/statistic/sites/?date_type=day#top', '/api/v2/group/{id}/statistic/sites/'),
+    ])
+    def test_normalize(self, url, expected):
+        self.assertEqual(la.collapse_ids(la.strip_query(url)), expected)
+
+    def test_max_urls(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        lines = [LOG_LINE.format(url='/api/v2/banner/{}?x={}'.format(i % 7, i), time='0.100') for i in range(200)]
+        file_log = write_log(tmp_dir.name, lines)
+        options = la.DEFAULT_OPTIONS._replace(normalizers=('strip_query',), max_urls=5)
+        serial = la.read_file(file_log, error_percent=0.4, options=options)
+        parallel = la.read_file(file_log, error_percent=0.4, workers=3, options=options)
+        self.assertEqual(list(serial), ['/api/v2/banner/{}'.format(i) for i in range(5)] + [la.OTHER_URL])
+        self.assertEqual(serial[la.OTHER_URL].count, sum(1 for i in range(200) if i % 7 >= 5))
+        self.assertEqual(sorted(la.compute_stat(serial, 10), key=lambda x: x['url']),
+                         sorted(la.compute_stat(parallel, 10), key=lambda x: x['url']))
+
+
+class TestReadFileCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        self.lines = sample_lines(500)
+        self.file_log = write_log(self.tmp_dir.name, self.lines[:300])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read(self, **kwargs):
+        return la.compute_stat(la.read_file(self.file_log, error_percent=0.4, cache_dir=self.cache_dir, **kwargs), 100)
+
+    def test_cache_hit(self):
+        first = self.read()
+        self.assertTrue(os.path.exists(la.get_cache_path(self.cache_dir, self.file_log)))
+        with unittest.mock.patch.object(la, 'parse_range') as parse_range:
+            second = self.read()
+        parse_range.assert_not_called()
+        self.assertEqual(first, second)
+
+    def test_resume_appended_file(self):
+        self.read()
+        with open(self.file_log.path_to_file, 'a') as f:
+            f.writelines(self.lines[300:])
+            f.write(self.lines[1][:40])
+        resumed = self.read(workers=2)
+        expected = la.compute_stat(la.read_file(self.file_log, error_percent=0.4), 100)
+        self.assertEqual(resumed, expected)
+        entry = la.load_cache(la.get_cache_path(self.cache_dir, self.file_log))
+        self.assertEqual(entry['n_lines'], 500)
+
+    def test_rewritten_file_is_not_resumed(self):
+        self.read()
+        with open(self.file_log.path_to_file, 'w') as f:
+            f.writelines(self.lines[200:])
+        expected = la.compute_stat(la.read_file(self.file_log, error_percent=0.4), 100)
+        self.assertEqual(self.read(), expected)
+
+    def test_last_line_without_newline(self):
+        with open(self.file_log.path_to_file, 'a') as f:
+            f.write(self.lines[300].rstrip('\n'))
+        expected = la.compute_stat(la.read_file(self.file_log, error_percent=0.4), 100)
+        for _ in range(2):
+            dict_url, counts = la.load_file(self.file_log, 0.4, cache_dir=self.cache_dir)
+            self.assertEqual(counts.lines + counts.cached_lines, 301)
+            self.assertEqual(la.compute_stat(dict_url, 100), expected)
+
+    def test_metrics_count_cached_lines_separately(self):
+        self.read()
+        size = os.path.getsize(self.file_log.path_to_file)
+        with open(self.file_log.path_to_file, 'a') as f:
+            f.writelines(self.lines[300:])
+        metrics = la.Metrics()
+        la.read_file(self.file_log, error_percent=0.4, cache_dir=self.cache_dir, metrics=metrics)
+        self.assertEqual((metrics.lines, metrics.cached_lines), (200, 300))
+        self.assertEqual((metrics.errors, metrics.cached_errors), (12, 18))
+        self.assertEqual((metrics.bytes, metrics.cached_bytes), (os.path.getsize(self.file_log.path_to_file) - size,
+                                                                 size))
+        metrics = la.Metrics()
+        la.read_file(self.file_log, error_percent=0.4, cache_dir=self.cache_dir, metrics=metrics)
+        self.assertEqual((metrics.lines, metrics.bytes, metrics.cached_lines), (0, 0, 500))
+
+    def test_options_change_invalidates_cache(self):
+        self.read()
+        approx = la.DEFAULT_OPTIONS._replace(median_mode=la.MEDIAN_APPROX)
+        with unittest.mock.patch.object(la, 'parse_range', wraps=la.parse_range) as parse_range:
+            self.read(options=approx)
+        parse_range.assert_called()
+
+
+class TestComputeStat(unittest.TestCase):
+    def test_top_matches_full_sort(self):
+        dict_url = {}
+        for i in range(300):
+            url_stat = dict_url['/url/{}'.format(i)] = la.UrlStat()
+            for j in range(i % 5 + 1):
+                url_stat.add((i * 7 + j) % 13 / 10.)
+        total_count = sum(url_stat.count for url_stat in dict_url.values())
+        total_times = sum(url_stat.time_sum for url_stat in dict_url.values())
+        expected = sorted([la.get_stat_row(url, url_stat, total_count, total_times)
+                           for url, url_stat in dict_url.items()], key=lambda x: x['time_sum'], reverse=True)
+        for report_size in (1, 10, 300, 1000):
+            self.assertEqual(la.compute_stat(dict_url, report_size), expected[:report_size])
+
+
+class TestDateRange(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.lines = sample_lines(600)
+        for i, day in enumerate(['20170629', '20170630', '20170701']):
+            write_log(self.tmp_dir.name, self.lines[i * 200:(i + 1) * 200], 'nginx-access-ui.log-' + day)
+        with gzip.open(os.path.join(self.tmp_dir.name, 'nginx-access-ui.log-20170702.gz'), 'wt') as f:
+            f.writelines(self.lines[:10])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_log_files(self):
+        file_logs = la.get_log_files(self.tmp_dir.name, datetime.date(2017, 6, 30), datetime.date(2017, 7, 2))
+        self.assertEqual([file_log.name for file_log in file_logs],
+                         ['nginx-access-ui.log-20170630', 'nginx-access-ui.log-20170701',
+                          'nginx-access-ui.log-20170702.gz'])
+
+    def test_get_latest_log_file(self):
+        file_log = la.get_latest_log_file(self.tmp_dir.name)
+        self.assertEqual(file_log, la.FILE_LOG(name='nginx-access-ui.log-20170702.gz', date=datetime.date(2017, 7, 2),
+                                               ext='.gz', path_to_file=os.path.join(self.tmp_dir.name,
+                                                                                    'nginx-access-ui.log-20170702.gz')))
+
+    def test_log_index(self):
+        index_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(index_dir.cleanup)
+        index_path = os.path.join(index_dir.name, 'index.json')
+        self.assertEqual(la.get_latest_log_file(self.tmp_dir.name, index_path).name, 'nginx-access-ui.log-20170702.gz')
+        self.assertEqual(len(la.load_log_index(index_path)['files']), 4)
+        with unittest.mock.patch.object(la.os, 'scandir') as scandir:
+            la.get_latest_log_file(self.tmp_dir.name, index_path)
+        scandir.assert_not_called()
+        write_log(self.tmp_dir.name, self.lines[:10], 'nginx-access-ui.log-20170801')
+        os.utime(self.tmp_dir.name, ns=(0, os.stat(self.tmp_dir.name).st_mtime_ns + 1))
+        self.assertEqual(la.get_latest_log_file(self.tmp_dir.name, index_path).name, 'nginx-access-ui.log-20170801')
+        self.assertEqual(len(la.load_log_index(index_path)['files']), 5)
+
+    def test_read_files_merges_days(self):
+        file_logs = la.get_log_files(self.tmp_dir.name, date_to=datetime.date(2017, 7, 1))
+        cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        merged = la.read_files(file_logs, error_percent=0.4, workers=2, cache_dir=cache_dir)
+        whole = write_log(self.tmp_dir.name, self.lines, 'whole.log')
+        expected = la.read_file(whole, error_percent=0.4)
+        self.assertEqual(la.compute_stat(merged, 100), la.compute_stat(expected, 100))
+        self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+
+class TestCreateReport(unittest.TestCase):
+    template = '<html>$$price ${title} $table_json\n<script>var table = ${table_json};</script>$ </html>'
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        with open(os.path.join(self.tmp_dir.name, 'report.html'), 'w') as f:
+            f.write(self.template)
+        self.report_path = os.path.join(self.tmp_dir.name, 'report-2017.06.30.html')
+
+    def test_matches_template_substitution(self):
+        for stat in ([], [{'url': '/a', 'count': 1, 'time_med': 0.1}, {'url': '/"b"', 'count': 2, 'time_med': 0.2}]):
+            la.create_report(self.tmp_dir.name, self.report_path, stat)
+            with open(self.report_path) as f:
+                report = f.read()
+            expected = string.Template(self.template).safe_substitute(table_json=json.dumps(stat))
+            self.assertEqual(report, expected)
+
+    def test_report_mode_follows_umask(self):
+        for umask in (0o022, 0o077):
+            previous = os.umask(umask)
+            try:
+                la.create_report(self.tmp_dir.name, self.report_path, [])
+            finally:
+                os.umask(previous)
+            self.assertEqual(os.stat(self.report_path).st_mode & 0o777, 0o666 & ~umask)
+
+    def test_no_partial_report_on_error(self):
+        with self.assertRaises(TypeError):
+            la.create_report(self.tmp_dir.name, self.report_path, [{'url': object()}])
+        self.assertEqual(os.listdir(self.tmp_dir.name), ['report.html'])
+
+
+class TestMain(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.log_dir = os.path.join(self.tmp_dir.name, 'log')
+        self.report_dir = os.path.join(self.tmp_dir.name, 'reports')
+        os.makedirs(self.log_dir)
+        os.makedirs(self.report_dir)
+        write_log(self.log_dir, sample_lines(300))
+        with open(os.path.join(self.report_dir, 'report.html'), 'w') as f:
+            f.write('<html><script>var table = $table_json;</script></html>')
+        self.metrics_path = os.path.join(self.tmp_dir.name, 'metrics.json')
+        self.config_path = os.path.join(self.tmp_dir.name, 'config.json')
+        with open(self.config_path, 'w') as f:
+            json.dump({'LOG_DIR': self.log_dir, 'REPORT_DIR': self.report_dir, 'CACHE_DIR': None,
+                       'METRICS_FILE': self.metrics_path}, f)
+
+    def run_main(self, *args):
+        with unittest.mock.patch.object(sys, 'argv', ['log_analyzer.py', '--config', self.config_path] + list(args)):
+            la.main()
+
+    def test_report_and_metrics(self):
+        self.run_main()
+        report_path = os.path.join(self.report_dir, 'report-2017.06.30.html')
+        with open(report_path) as f:
+            report = f.read()
+        self.assertIn('/api/v2/banner/1', report)
+        with open(self.metrics_path) as f:
+            metrics = json.load(f)
+        self.assertEqual(set(metrics['stages']), {'discovery', 'parse', 'aggregate', 'render'})
+        self.assertEqual(metrics['lines'], 300)
+        self.assertEqual(metrics['errors'], 18)
+        self.assertGreater(metrics['lines_per_sec'], 0)
+
+    def test_profile(self):
+        profile_path = os.path.join(self.tmp_dir.name, 'run.prof')
+        self.run_main('--profile', profile_path)
+        self.assertTrue(os.path.exists(profile_path))
+
+
+class TestLogWatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.log_dir = os.path.join(self.tmp_dir.name, 'log')
+        self.report_dir = os.path.join(self.tmp_dir.name, 'reports')
+        os.makedirs(self.log_dir)
+        os.makedirs(self.report_dir)
+        with open(os.path.join(self.report_dir, 'report.html'), 'w') as f:
+            f.write('$table_json')
+        self.lines = sample_lines(300)
+        self.file_log = write_log(self.log_dir, self.lines[:100])
+        config = dict(la.LOCAL_CONFIG, LOG_DIR=self.log_dir, REPORT_DIR=self.report_dir, REPORT_INTERVAL=0)
+        self.watcher = la.LogWatcher(config)
+
+    def read_report(self, name):
+        with open(os.path.join(self.report_dir, name)) as f:
+            return json.load(f)
+
+    def test_tail_appended_lines(self):
+        self.watcher.poll()
+        self.assertEqual(self.watcher.n_lines, 100)
+        with open(self.file_log.path_to_file, 'a') as f:
+            f.writelines(self.lines[100:])
+            f.write(self.lines[1][:30])
+        self.watcher.run(max_polls=1)
+        self.assertEqual(self.watcher.n_lines, 300)
+        expected = la.compute_stat(la.read_file(write_log(self.tmp_dir.name, self.lines), error_percent=0.4), 1000)
+        self.assertEqual(self.read_report('report-2017.06.30.html'), expected)
+
+    def test_rotation(self):
+        self.watcher.poll()
+        write_log(self.log_dir, self.lines[100:150], 'nginx-access-ui.log-20170701')
+        self.watcher.poll()
+        self.assertEqual(len(self.read_report('report-2017.06.30.html')), 7)
+        self.assertEqual(self.watcher.file_log.name, 'nginx-access-ui.log-20170701')
+        self.assertEqual(self.watcher.n_lines, 50)
+
+    def test_truncated_file(self):
+        self.watcher.poll()
+        write_log(self.log_dir, self.lines[:10])
+        self.watcher.poll()
+        self.assertEqual(self.watcher.n_lines, 10)
+
+
+@unittest.skipIf(la.np is None, 'numpy is not installed')
+class TestNumpyBackend(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        lines = sample_lines(2000)
+        lines += [LOG_LINE.format(url='/api/{}?q={}'.format(i % 11, i), time='{:.3f}'.format(i % 97 / 31.))
+                  for i in range(3000)]
+        self.file_log = write_log(self.tmp_dir.name, lines)
+
+    def compare(self, **option_values):
+        options = la.DEFAULT_OPTIONS._replace(**option_values)
+        python = la.read_file(self.file_log, error_percent=0.4, options=options)
+        vectorized = la.read_file(self.file_log, error_percent=0.4, workers=2,
+                                  options=options._replace(backend=la.BACKEND_NUMPY))
+        self.assertEqual(list(python), list(vectorized))
+        self.assertEqual(la.compute_stat(python, 1000), la.compute_stat(vectorized, 1000))
+
+    def test_exact(self):
+        self.compare()
+
+    def test_approx(self):
+        self.compare(median_mode=la.MEDIAN_APPROX)
+
+    def test_max_urls(self):
+        self.compare(normalizers=('strip_query',), max_urls=9)
+
+    def test_group_times_matches_url_stat(self):
+        rnd = random.Random(3)
+        urls = ['/url/{}'.format(i) for i in range(300)]
+        ids = array('q')
+        times = array('d')
+        for _ in range(5000):
+            ids.append(rnd.randrange(len(urls)) if rnd.random() < .7 else rnd.randrange(5))
+            times.append(rnd.choice([0., 0.001, 0.5, round(rnd.random() * 3, 3)]))
+        for median_mode in (la.MEDIAN_EXACT, la.MEDIAN_APPROX):
+            expected = {}
+            for url_id, request_time in zip(ids, times):
+                expected.setdefault(urls[url_id], la.UrlStat(median_mode)).add(request_time)
+            grouped = la.group_times(urls, ids, times, median_mode)
+            self.assertEqual(set(grouped), set(expected))
+            for url, url_stat in expected.items():
+                self.assertEqual((grouped[url].count, grouped[url].time_total, grouped[url].time_max),
+                                 (url_stat.count, url_stat.time_total, url_stat.time_max))
+                self.assertEqual(grouped[url].median(), url_stat.median())
+                if median_mode == la.MEDIAN_APPROX:
+                    self.assertEqual(grouped[url].times.to_state(), url_stat.times.to_state())
+
+    def test_fallback_without_numpy(self):
+        config = dict(la.LOCAL_CONFIG, AGG_BACKEND=la.BACKEND_NUMPY)
+        with unittest.mock.patch.object(la, 'np', None):
+            self.assertEqual(la.get_parse_options(config).backend, la.BACKEND_PYTHON)
+
+
+class TestParseOptions(unittest.TestCase):
+    def test_unknown_values(self):
+        for name, value in [('MEDIAN_MODE', 'aprox'), ('PARSER', 'slow'), ('AGG_BACKEND', 'pandas'),
+                            ('URL_NORMALIZERS', ['lower'])]:
+            with self.assertRaises(ValueError):
+                la.get_parse_options(dict(la.LOCAL_CONFIG, **{name: value}))
+
+
+class TestUrlStat(unittest.TestCase):
+    times = [0.39, 0.133, 0.2, 1.5, 0.001, 0.2, 0.7, 3.0]
+
+    def test_exact_median(self):
+        url_stat = la.UrlStat()
+        for t in self.times:
+            url_stat.add(t)
+        self.assertEqual(url_stat.count, len(self.times))
+        self.assertEqual(url_stat.time_max, max(self.times))
+        self.assertAlmostEqual(url_stat.time_sum, sum(self.times))
+        self.assertEqual(url_stat.median(), median(self.times))
+
+    def test_approx_median_bounded_error(self):
+        url_stat = la.UrlStat(la.MEDIAN_APPROX)
+        times = [i / 1000. for i in range(1, 10001)]
+        for t in times:
+            url_stat.add(t)
+        self.assertLessEqual(abs(url_stat.median() - median(times)), median(times) * la.QuantileSketch.ALPHA * 1.5)
+
+    def test_approx_median_even_count(self):
+        url_stat = la.UrlStat(la.MEDIAN_APPROX)
+        times = [0.1, 0.2, 1.0, 3.0]
+        for t in times:
+            url_stat.add(t)
+        self.assertLessEqual(abs(url_stat.median() - median(times)), median(times) * la.QuantileSketch.ALPHA)
+
+    def test_merge(self):
+        left, right, whole = la.UrlStat(la.MEDIAN_APPROX), la.UrlStat(la.MEDIAN_APPROX), la.UrlStat(la.MEDIAN_APPROX)
+        for i, t in enumerate(self.times):
+            (left if i % 2 else right).add(t)
+            whole.add(t)
+        left.median()
+        left.merge(right)
+        self.assertEqual(left.count, whole.count)
+        self.assertEqual(left.time_max, whole.time_max)
+        self.assertEqual(left.median(), whole.median())
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
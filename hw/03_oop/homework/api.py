@@ -1,13 +1,20 @@
 
 import json
-from datetime import datetime
+from datetime import date, datetime, timedelta
+import functools
 import logging
 import hashlib
+import hmac
+import socket
+import time
 import uuid
 
 from optparse import OptionParser
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from scoring import get_score, get_interests
+from scoring import get_score, get_scores, get_interests_many
+import async_server
+import prefork
+import scoring
 import store
 
 SALT = "Otus"
@@ -26,6 +33,7 @@ ERRORS = {
     INVALID_REQUEST: "Invalid Request",
     INTERNAL_ERROR: "Internal Server Error",
 }
+MAX_BATCH_SIZE = 1000
 UNKNOWN = 0
 MALE = 1
 FEMALE = 2
@@ -42,113 +50,179 @@ class Field:
     def __init__(self, required=False, nullable=False):
         self.required = required
         self.nullable = nullable
-        self.is_correct = True
-        self.value = None
+        self.name = None
+        self.slot = None
 
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.slot = "_" + name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return getattr(instance, self.slot, None)
+
+    def __set__(self, instance, value):
+        setattr(instance, self.slot, value)
 
     def validate(self, value):
-        if not value and self.required:
-            self.is_correct = False
-        if not value and not self.nullable:
-            self.is_correct = False
-        if self.is_correct:
-            self.value = value
-        else:
-            raise ValueError('Invalid value')
-    def __str__(self):
-        return str(self.value)
+        if value in self.empty_values:
+            if not self.nullable:
+                raise ValueError("Field can't be empty")
+            return value
+        return self.clean(value)
+
+    def clean(self, value):
+        return value
 
 
 class CharField(Field):
-    def validate(self, value):
-        super().validate(value)
+    def clean(self, value):
+        if not isinstance(value, str):
+            raise ValueError('Should be a string')
+        return value
+
 
-class ArgumentsField(CharField):
-    pass
+class ArgumentsField(Field):
+    def clean(self, value):
+        if not isinstance(value, dict):
+            raise ValueError('Should be a dict')
+        return value
 
 
 class EmailField(CharField):
-    def validate(self, value):
-        super().validate(value)
+    def clean(self, value):
+        value = super().clean(value)
         if '@' not in value:
-            self.is_correct = False
-        if self.is_correct:
-            self.value = value
-        else:
             raise ValueError('Invalid value')
-        return self.value
+        return value
 
 
-class PhoneField(CharField):
-    def validate(self, value):
-        super().validate(value)
-        if value and self.is_correct:
-            try:
-                int(value)
-            except ValueError:
-                self.is_correct = False
-            if not value.startswith("7") or len(value) != 11:
-                self.is_correct = False
-        if self.is_correct:
-            self.value = value
-        else:
+class PhoneField(Field):
+    def clean(self, value):
+        if not isinstance(value, (str, int)) or isinstance(value, bool):
+            raise ValueError('Should be a string or an int')
+        phone = str(value)
+        if not phone.isdigit() or not phone.startswith("7") or len(phone) != 11:
             raise ValueError('Invalid value')
+        return value
+
 
-        return self.value
+@functools.lru_cache(maxsize=1024)
+def parse_date(value):
+    # dd.mm.yyyy without strptime; invalid days/months still raise ValueError from date()
+    if len(value) != 10 or value[2] != "." or value[5] != "." \
+            or not (value[:2] + value[3:5] + value[6:]).isdigit():
+        raise ValueError("Wrong date format. should be dd.mm.yyyy")
+    return date(int(value[6:]), int(value[3:5]), int(value[:2]))
 
 
+class Today:
+    # date.today() changes once a day, so it is recomputed only after midnight
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.date = None
+        self.expires_at = 0
+
+    def get(self):
+        now = self.clock()
+        if now >= self.expires_at:
+            self.date = date.fromtimestamp(now)
+            self.expires_at = datetime.combine(self.date + timedelta(days=1), datetime.min.time()).timestamp()
+        return self.date
+
+
+today = Today()
+
 
 class DateField(CharField):
-    def validate(self, value):
-        super().validate(value)
+    def parse(self, value):
+        value = super().clean(value)
+        try:
+            return parse_date(value)
+        except ValueError:
+            raise ValueError("Wrong date format. should be dd.mm.yyyy")
+
+    def clean(self, value):
+        self.parse(value)
+        return value
 
 
 class BirthDayField(DateField):
-    def validate(self, value):
-        super().validate(value)
-        if value and self.is_correct:
-            try:
-                value = datetime.strptime(value, "%d.%m.%Y")
-            except ValueError:
-                raise ValueError("Wrong date format. should be dd-mm-yyyy")
-            delta = datetime.today() - value
-            if delta.days/365 > 70:
-                raise ValueError("Delta should be less than 70 years")
-        if self.is_correct:
-            self.value = value.strftime("%d.%m.%Y")
-        return self.value
-
-
-class GenderField(CharField):
-    def validate(self, value):
-        super().validate(value)
-        if value not in [0, 1, 2]:
-            self.is_correct = False
-        if self.is_correct:
-            self.value = value
-        else:
+    def clean(self, value):
+        delta = today.get() - self.parse(value)
+        if delta.days/365 > 70:
+            raise ValueError("Delta should be less than 70 years")
+        return value
+
+
+class GenderField(Field):
+    def clean(self, value):
+        if not isinstance(value, int) or isinstance(value, bool) or value not in GENDERS:
             raise ValueError('Invalid value')
-        return self.value
+        return value
 
 
+class ArgumentsListField(Field):
+    def __init__(self, max_size=None, **kwargs):
+        super().__init__(**kwargs)
+        self.max_size = max_size
+
+    def clean(self, value):
+        if not isinstance(value, list) or not all(isinstance(i, dict) for i in value):
+            raise ValueError('Should be a list of dicts')
+        if self.max_size is not None and len(value) > self.max_size:
+            raise ValueError('Should contain at most %s items' % self.max_size)
+        return value
 
-class ClientIDsField(Field):
-    pass
 
+class ClientIDsField(Field):
+    def clean(self, value):
+        if not isinstance(value, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in value):
+            raise ValueError('Should be a list of ints')
+        return value
+
+
+class RequestMeta(type):
+    # collects the Field descriptors once per class: values live in private slots
+    # of each request instance, the validator chain is a tuple walked by Request.validate
+    def __new__(mcs, name, bases, namespace):
+        own_slots = tuple("_" + key for key, value in namespace.items() if isinstance(value, Field))
+        namespace["__slots__"] = tuple(namespace.get("__slots__", ())) + own_slots
+        cls = super().__new__(mcs, name, bases, namespace)
+        fields = {}
+        for klass in reversed(cls.__mro__):
+            fields.update((key, value) for key, value in vars(klass).items() if isinstance(value, Field))
+        cls.fields = tuple(fields.values())
+        cls.validators = tuple((field.name, field.slot, field.required, field.validate) for field in cls.fields)
+        return cls
+
+
+class Request(metaclass=RequestMeta):
+    __slots__ = ("data", "errors", "is_valid")
 
-class Request:
     def __init__(self, data):
-        self.data = data
+        self.data = data if isinstance(data, dict) else {}
+        self.errors = []
+        self.is_valid = False
 
     def validate(self):
-        self.errors = []
-        for name, field in self.data.items():
-            obj_ = getattr(self, name, None)
-            obj_.validate(field)
-            val_status = obj_.is_correct
-            if val_status == False:
-                self.errors.append(val_status)
-        self.is_valid = False if self.errors else True
+        errors = []
+        data = self.data
+        for name, slot, required, validate in self.validators:
+            if name not in data:
+                if required:
+                    errors.append("%s: Field is required" % name)
+                setattr(self, slot, None)
+                continue
+            try:
+                setattr(self, slot, validate(data[name]))
+            except ValueError as e:
+                errors.append("%s: %s" % (name, e))
+                setattr(self, slot, None)
+        self.errors = errors
+        self.is_valid = not errors
+
 
 class MethodRequest(Request):
     account = CharField(required=False, nullable=True)
@@ -159,14 +233,13 @@ class MethodRequest(Request):
 
     @property
     def get_method(self):
-        return self.method.value
+        return self.method
 
     @property
     def is_admin(self):
         return self.login == ADMIN_LOGIN
 
 
-
 class OnlineScoreRequest(Request):
     first_name = CharField(required=False, nullable=True)
     last_name = CharField(required=False, nullable=True)
@@ -174,29 +247,76 @@ class OnlineScoreRequest(Request):
     phone = PhoneField(required=False, nullable=True)
     birthday = BirthDayField(required=False, nullable=True)
     gender = GenderField(required=False, nullable=True)
+    required_pairs = ({"phone", "email"}, {"first_name", "last_name"}, {"gender", "birthday"})
 
+    def validate(self):
+        super().validate()
+        has = set(self.check_non_empty())
+        if self.is_valid and not any(pair <= has for pair in self.required_pairs):
+            self.errors.append("At least one pair of phone-email, first_name-last_name, gender-birthday is required")
+            self.is_valid = False
 
     def check_non_empty(self):
-        non_empty_lst = []
-        for name, field in self.data.items():
-            if field:
-                non_empty_lst.append(name)
-        return non_empty_lst
+        return [field.name for field in self.fields if self.data.get(field.name) not in Field.empty_values]
+
+    def score_arguments(self):
+        return {field.name: getattr(self, field.name) for field in self.fields}
+
 
+class AdminDigest:
+    # the admin token changes once an hour, so the digest is recomputed only after the hour boundary
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.digest = None
+        self.expires_at = 0
+
+    def get(self):
+        now = self.clock()
+        if now >= self.expires_at:
+            hour = datetime.fromtimestamp(now).replace(minute=0, second=0, microsecond=0)
+            self.digest = hashlib.sha512(bytes(hour.strftime("%Y%m%d%H") + ADMIN_SALT, "utf-8")).hexdigest()
+            self.expires_at = (hour + timedelta(hours=1)).timestamp()
+        return self.digest
+
+
+admin_digest = AdminDigest()
+
+
+def user_digest(account, login):
+    return hashlib.sha512(bytes(account + login + SALT, "utf-8")).hexdigest()
+
+
+# digests of users that passed authentication; failed attempts are never cached,
+# so requests with made-up logins cannot evict the entries of valid users
+user_digests = store.LocalCache(max_size=10000, ttl=24 * 60 * 60)
 
 
 def check_auth(request):
     if request.is_admin:
-        digest = hashlib.sha512(bytes(datetime.datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT, "utf-8")).hexdigest()
-    else:
-        digest = hashlib.sha512(bytes(str(request.account) + str(request.login) + SALT, "utf-8")).hexdigest()
-    if digest == str(request.token):
-        return True
-    return False
+        return hmac.compare_digest(bytes(admin_digest.get(), "utf-8"), bytes(request.token or "", "utf-8"))
+    key = (request.account or "", request.login or "")
+    digest = user_digests.get(key)
+    if digest is not None:
+        return hmac.compare_digest(bytes(digest, "utf-8"), bytes(request.token or "", "utf-8"))
+    digest = user_digest(*key)
+    valid = hmac.compare_digest(bytes(digest, "utf-8"), bytes(request.token or "", "utf-8"))
+    if valid:
+        user_digests.set(key, digest)
+    return valid
+
+
+def log_cache_stats(context, store):
+    context["score_cache_hit_ratio"] = round(scoring.score_cache_stats.hit_ratio(), 3)
+    # hits/misses/evictions of the in-process tier; test doubles of the store may not have one
+    local_cache_stats = getattr(store, "local_cache_stats", None)
+    stats = local_cache_stats() if local_cache_stats is not None else None
+    if stats is not None:
+        context["local_cache"] = stats
+
 
 class OnlineScoreHandler:
     def process_request(self, request, context, store):
-        r = OnlineScoreRequest(request.data['arguments'])
+        r = OnlineScoreRequest(request.arguments)
         r.validate()
         if not r.is_valid:
             return r.errors, INVALID_REQUEST
@@ -204,35 +324,64 @@ class OnlineScoreHandler:
             score = 42
         else:
             score = get_score(store, r.phone, r.email, r.birthday, r.gender, r.first_name, r.last_name)
+            log_cache_stats(context, store)
         context["has"] = r.check_non_empty()
         return {"score": score}, OK
 
 
-class ClientsInterestsRequest(Request):
-    client_ids = ClientIDsField(required=True)
-    date = DateField(required=False, nullable=True)
+class OnlineScoreBatchRequest(Request):
+    items = ArgumentsListField(required=True, max_size=MAX_BATCH_SIZE)
 
 
+class OnlineScoreBatchHandler:
+    def process_request(self, request, context, store):
+        r = OnlineScoreBatchRequest(request.arguments)
+        r.validate()
+        if not r.is_valid:
+            return r.errors, INVALID_REQUEST
+        results = [None] * len(r.items)
+        valid = []
+        for i, arguments in enumerate(r.items):
+            item = OnlineScoreRequest(arguments)
+            item.validate()
+            if item.is_valid:
+                valid.append((i, item))
+            else:
+                results[i] = {"error": item.errors, "code": INVALID_REQUEST}
+        if request.is_admin:
+            scores = [42] * len(valid)
+        else:
+            scores = get_scores(store, [item.score_arguments() for _, item in valid])
+            log_cache_stats(context, store)
+        for (i, _), score in zip(valid, scores):
+            results[i] = {"response": {"score": score}, "code": OK}
+        context["nitems"] = len(results)
+        context["nvalid"] = len(valid)
+        return {"results": results}, OK
 
 
-    def cnt_ids(self):
-        return len(self.client_ids.value)
+class ClientsInterestsRequest(Request):
+    client_ids = ClientIDsField(required=True)
+    date = DateField(required=False, nullable=True)
 
+    def cnt_ids(self):
+        return len(self.client_ids)
 
 
 class ClientInterestHandler:
     def process_request(self, request, context, store):
-        r = ClientsInterestsRequest(request.data['arguments'])
+        r = ClientsInterestsRequest(request.arguments)
         r.validate()
         if not r.is_valid:
             return r.errors, INVALID_REQUEST
-        context["nclients"] = len(r.client_ids.value)
-        response_body = {cid: get_interests(store, cid) for cid in r.client_ids.value}
+        context["nclients"] = r.cnt_ids()
+        response_body = get_interests_many(store, r.client_ids)
         return response_body, OK
 
 
 def method_handler(request, ctx, store):
     handlers = {'online_score': OnlineScoreHandler,
+                'online_score_batch': OnlineScoreBatchHandler,
                 'clients_interests': ClientInterestHandler}
 
     method_request = MethodRequest(request["body"])
@@ -249,62 +398,112 @@ def method_handler(request, ctx, store):
     return response, code
 
 
+def get_request_id(headers):
+    return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
+
+
+def process_http_request(path, data_string, headers, store, router=None):
+    router = router if router is not None else {"method": method_handler}
+    response, code = {}, OK
+    context = {"request_id": get_request_id(headers)}
+    request = None
+    try:
+        request = json.loads(data_string)
+    except:
+        code = BAD_REQUEST
+
+    if request:
+        route = path.strip("/")
+        logging.info("%s: %s %s" % (path, data_string, context["request_id"]))
+        if route in router:
+            try:
+                response, code = router[route]({"body": request, "headers": headers}, context, store)
+            except Exception as e:
+                logging.exception("Unexpected error: %s" % e)
+                code = INTERNAL_ERROR
+        else:
+            code = NOT_FOUND
+
+    if code not in ERRORS:
+        r = {"response": response, "code": code}
+    else:
+        r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
+    context.update(r)
+    logging.info(context)
+    return code, r
+
+
+def make_store(max_connections=50):
+    return store.Storage(store.RedisStorage(max_connections=max_connections), store.LocalCache())
+
+
 class MainHTTPHandler(BaseHTTPRequestHandler):
     router = {
         "method": method_handler
     }
-    store = store.Storage(store.RedisStorage())
+    store = make_store()
 
     def get_request_id(self, headers):
-        return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
+        return get_request_id(headers)
 
     def do_POST(self):
-        response, code = {}, OK
-        context = {"request_id": self.get_request_id(self.headers)}
-        request = None
+        data_string = None
         try:
             data_string = self.rfile.read(int(self.headers['Content-Length']))
-            request = json.loads(data_string)
         except:
-            code = BAD_REQUEST
-
-        if request:
-            path = self.path.strip("/")
-            logging.info("%s: %s %s" % (self.path, data_string, context["request_id"]))
-            if path in self.router:
-                try:
-                    response, code = self.router[path]({"body": request, "headers": self.headers}, context, self.store)
-                except Exception as e:
-                    logging.exception("Unexpected error: %s" % e)
-                    code = INTERNAL_ERROR
-            else:
-                code = NOT_FOUND
-
+            pass
+        code, r = process_http_request(self.path, data_string, self.headers, self.store, self.router)
         self.send_response(code)
         self.send_header("Content-Type", "application/json")
         self.end_headers()
-        if code not in ERRORS:
-            r = {"response": response, "code": code}
-        else:
-            r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
-        context.update(r)
-        logging.info(context)
         self.wfile.write(bytes(json.dumps(r), "utf-8"))
         return
 
 
+def handle_async_request(path, data_string, headers):
+    code, r = process_http_request(path, data_string, headers, MainHTTPHandler.store, MainHTTPHandler.router)
+    return code, bytes(json.dumps(r), "utf-8")
+
+
+def serve_http(server):
+    # a fresh storage per process: redis connections must not be shared across fork
+    MainHTTPHandler.store = make_store()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+def serve_async(sock, concurrency):
+    # each handler thread holds at most one redis connection at a time
+    MainHTTPHandler.store = make_store(max_connections=concurrency)
+    try:
+        # request fields are stored per instance, so requests may be handled in parallel threads
+        async_server.run(handle_async_request, concurrency=concurrency, sock=sock, threads=concurrency)
+    except KeyboardInterrupt:
+        pass
+
+
 if __name__ == "__main__":
     op = OptionParser()
     op.add_option("-p", "--port", action="store", type=int, default=8080)
     op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("--async", action="store_true", dest="use_async", default=False)
+    op.add_option("--concurrency", action="store", type=int, default=100)
+    op.add_option("-w", "--workers", action="store", type=int, default=1)
     (opts, args) = op.parse_args()
     logging.basicConfig(filename=opts.log, level=logging.INFO,
                         format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
-    server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
-    logging.info("Starting server at %s" % opts.port)
-    try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        pass
-    server.server_close()
-
+    if opts.use_async:
+        sock = socket.create_server(("localhost", opts.port))
+        logging.info("Starting async server at %s" % opts.port)
+        worker = functools.partial(serve_async, sock, opts.concurrency)
+    else:
+        server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
+        logging.info("Starting server at %s" % opts.port)
+        worker = functools.partial(serve_http, server)
+    if opts.workers > 1:
+        prefork.run(worker, opts.workers)
+    else:
+        worker()
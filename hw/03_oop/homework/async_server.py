@@ -0,0 +1,127 @@
+import asyncio
+import http.client
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+MAX_LINE_SIZE = 64 * 1024
+MAX_HEADERS = 100
+KEEP_ALIVE_TIMEOUT = 15
+
+
+class BadRequest(Exception):
+    pass
+
+
+class AsyncHTTPServer:
+    # handler(path, body, headers) -> (code, response_bytes) blocks on storage access,
+    # so it runs in a pool of `threads` threads; at most `concurrency` requests are processed at once;
+    # a single thread (the default) is the only safe choice for a handler that is not thread-safe
+
+    def __init__(self, handler, host="localhost", port=8080, concurrency=100, sock=None, threads=1):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.sock = sock
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.semaphore = None
+        self.server = None
+
+    async def start(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        if self.sock is not None:
+            self.server = await asyncio.start_server(self.handle_connection, sock=self.sock, limit=MAX_LINE_SIZE)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, self.host, self.port,
+                                                     limit=MAX_LINE_SIZE)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.server
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        self.executor.shutdown(wait=False)
+
+    async def read_request(self, reader):
+        line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+        if not line:
+            return None
+        try:
+            method, path, version = line.decode("latin-1").split()
+        except ValueError:
+            raise BadRequest("Bad request line %r" % line)
+        raw_headers = []
+        while True:
+            header_line = await reader.readline()
+            if header_line in (b"\r\n", b"\n", b""):
+                break
+            raw_headers.append(header_line)
+            if len(raw_headers) > MAX_HEADERS:
+                raise BadRequest("Too many headers")
+        headers = http.client.parse_headers(io.BytesIO(b"".join(raw_headers) + b"\r\n"))
+        body = None
+        if headers.get("Content-Length") is not None:
+            try:
+                length = int(headers["Content-Length"])
+            except ValueError:
+                raise BadRequest("Bad Content-Length")
+            body = await reader.readexactly(length)
+        return method, path, version, headers, body
+
+    @staticmethod
+    def is_keep_alive(version, headers):
+        connection = (headers.get("Connection") or "").lower()
+        if version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    @staticmethod
+    async def write_response(writer, code, body, keep_alive):
+        status = HTTPStatus(code)
+        head = "HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n" % (
+            code, status.phrase, len(body), "keep-alive" if keep_alive else "close")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except BadRequest as e:
+                    logging.info("Bad request: %s" % e)
+                    await self.write_response(writer, HTTPStatus.BAD_REQUEST, b"", keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, version, headers, body = request
+                keep_alive = self.is_keep_alive(version, headers)
+                if method != "POST":
+                    code, response = HTTPStatus.NOT_IMPLEMENTED, b""
+                else:
+                    async with self.semaphore:
+                        code, response = await loop.run_in_executor(self.executor, self.handler,
+                                                                    path, body, headers)
+                await self.write_response(writer, code, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+def run(handler, host="localhost", port=8080, concurrency=100, sock=None, threads=1):
+    server = AsyncHTTPServer(handler, host, port, concurrency, sock, threads)
+    try:
+        asyncio.run(server.serve_forever())
+    finally:
+        server.close()
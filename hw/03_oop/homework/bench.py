@@ -0,0 +1,112 @@
+import argparse
+import datetime
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import api
+
+METHOD_REQUEST = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "x" * 128,
+                  "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru", "gender": 1,
+                                "birthday": "01.01.2000", "first_name": "a", "last_name": "b"}}
+
+
+def validate_request(data):
+    request = api.MethodRequest(data)
+    request.validate()
+    arguments = api.OnlineScoreRequest(request.arguments)
+    arguments.validate()
+    return arguments.is_valid
+
+
+def check_auth_uncached(request):
+    # previous implementation: a fresh sha512 per request and a plain string comparison
+    if request.is_admin:
+        digest = hashlib.sha512(bytes(datetime.datetime.now().strftime("%Y%m%d%H") + api.ADMIN_SALT,
+                                      "utf-8")).hexdigest()
+    else:
+        digest = hashlib.sha512(bytes(str(request.account) + str(request.login) + api.SALT, "utf-8")).hexdigest()
+    return digest == str(request.token)
+
+
+def make_auth_request(login):
+    request = api.MethodRequest(dict(METHOD_REQUEST, login=login))
+    request.validate()
+    request.token = api.admin_digest.get() if login == api.ADMIN_LOGIN else api.user_digest(request.account, login)
+    return request
+
+
+def repeat(func, n):
+    for _ in range(n):
+        func()
+
+
+def run(func, n, threads=1):
+    # wall time per call; with threads each worker runs its share in a loop,
+    # so the number shows contention rather than the executor's per-task overhead
+    start = time.perf_counter()
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(lambda _: repeat(func, n // threads), range(threads)))
+    else:
+        repeat(func, n)
+    return (time.perf_counter() - start) / n * 10 ** 6
+
+
+def bench_validation(args):
+    for threads in args.threads:
+        usec = run(lambda: validate_request(METHOD_REQUEST), args.n, threads)
+        print("validation threads={:<3} {:>8.2f} usec/request".format(threads, usec))
+
+
+def bench_auth(args):
+    for login in ["h&f", api.ADMIN_LOGIN]:
+        request = make_auth_request(login)
+        for name, check_auth in [('uncached', check_auth_uncached), ('cached', api.check_auth)]:
+            if not check_auth(request):
+                raise AssertionError('%s rejected a valid token' % name)
+            usec = run(lambda: check_auth(request), args.n)
+            print("auth {:<6} {:<9} {:>8.2f} usec/request".format(login, name, usec))
+
+
+def parse_dates_cold(values):
+    # every date is a cache miss: the lru_cache is emptied before each pass
+    api.parse_date.cache_clear()
+    return [api.parse_date(value) for value in values]
+
+
+def bench_dates(args):
+    start = datetime.date(1950, 1, 1)
+    values = [(start + datetime.timedelta(days=i)).strftime("%d.%m.%Y") for i in range(args.dates)]
+    for name, parse in [('strptime', lambda: [datetime.datetime.strptime(value, "%d.%m.%Y") for value in values]),
+                        ('uncached', lambda: [api.parse_date.__wrapped__(value) for value in values]),
+                        ('cold', lambda: parse_dates_cold(values)),
+                        ('warm', lambda: [api.parse_date(value) for value in values])]:
+        usec = run(parse, max(args.n // len(values), 1)) / len(values)
+        print("dates {:<10} {:>8.2f} usec/date".format(name, usec))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    validation = subparsers.add_parser('validation', help='MethodRequest + OnlineScoreRequest validation')
+    validation.add_argument("-n", type=int, default=10 ** 5)
+    validation.add_argument("--threads", type=int, nargs='+', default=[1, 8])
+    validation.set_defaults(func=bench_validation)
+
+    auth = subparsers.add_parser('auth', help='check_auth for user and admin tokens')
+    auth.add_argument("-n", type=int, default=10 ** 5)
+    auth.set_defaults(func=bench_auth)
+
+    dates = subparsers.add_parser('dates', help='dd.mm.yyyy parsing for DateField/BirthDayField')
+    dates.add_argument("-n", type=int, default=10 ** 5)
+    dates.add_argument("--dates", type=int, default=1000, help='distinct dates in the sample')
+    dates.set_defaults(func=bench_dates)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
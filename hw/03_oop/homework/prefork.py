@@ -0,0 +1,83 @@
+import logging
+import os
+import signal
+import time
+
+SHUTDOWN_TIMEOUT = 10
+MIN_WORKER_LIFETIME = 1
+
+
+class Shutdown(Exception):
+    pass
+
+
+def raise_shutdown(signum, frame):
+    raise Shutdown()
+
+
+def raise_interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def spawn(worker):
+    pid = os.fork()
+    if pid:
+        return pid
+    # in a worker SIGTERM stops serve_forever the same way Ctrl+C does
+    signal.signal(signal.SIGTERM, raise_interrupt)
+    signal.signal(signal.SIGINT, raise_interrupt)
+    code = 0
+    try:
+        worker()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logging.exception("Worker %s failed: %s" % (os.getpid(), e))
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def stop_workers(workers, timeout=SHUTDOWN_TIMEOUT):
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + timeout
+    while workers and time.monotonic() < deadline:
+        pid, _ = os.waitpid(-1, os.WNOHANG)
+        if pid:
+            workers.pop(pid, None)
+        else:
+            time.sleep(0.05)
+    for pid in workers:
+        logging.info("Worker %s did not stop in %ss, killing" % (pid, timeout))
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+
+def run(worker, n_workers):
+    # worker() runs in every forked process and serves the already listening socket;
+    # crashed workers are restarted, SIGTERM/SIGINT stops all of them
+    previous_handlers = {sig: signal.signal(sig, raise_shutdown) for sig in (signal.SIGTERM, signal.SIGINT)}
+    workers = {}
+    try:
+        for _ in range(n_workers):
+            workers[spawn(worker)] = time.monotonic()
+        logging.info("Started workers %s" % sorted(workers))
+        while True:
+            pid, status = os.wait()
+            started = workers.pop(pid, None)
+            if started is None:
+                continue
+            logging.info("Worker %s exited with status %s, restarting" % (pid, os.waitstatus_to_exitcode(status)))
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            workers[spawn(worker)] = time.monotonic()
+    except Shutdown:
+        logging.info("Stopping workers %s" % sorted(workers))
+        stop_workers(workers)
+    finally:
+        for sig, handler in previous_handlers.items():
+            signal.signal(sig, handler)
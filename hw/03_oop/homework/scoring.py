@@ -20,21 +20,67 @@
 
 import hashlib
 import json
+import threading
 
 
-def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
-    key_parts = [
-        first_name or "",
-        last_name or "",
-        phone or "",
-        birthday.strftime("%Y%m%d") if birthday is not None else "",
-    ]
-    key = "uid:" + hashlib.md5("".join(key_parts)).hexdigest()
-    # try get from cache,
-    # fallback to heavy calculation in case of cache miss
-    score = store.cache_get(key) or 0
-    if score:
-        return score
+SCORE_TTL = 60 * 60
+NEGATIVE_SCORE_TTL = 5 * 60
+# cached marker for a zero score: a plain 0 would be indistinguishable from a miss
+NO_SCORE = "-"
+
+
+class CacheStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hits=0, misses=0):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": self.hit_ratio()}
+
+
+score_cache_stats = CacheStats()
+
+
+def get_score_key(phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+    # every input of the score is part of the key; json keeps the encoding unambiguous
+    # and phone 79175002040 and "79175002040" map to the same key
+    key_parts = [str(phone) if phone else None, email or None, birthday or None, gender,
+                 first_name or None, last_name or None]
+    data = json.dumps(key_parts, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return "score:" + hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def encode_score(score):
+    return NO_SCORE if score == 0 else repr(float(score))
+
+
+def decode_score(value):
+    if value is None:
+        return None
+    if value == NO_SCORE:
+        return 0
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_score_ttl(score):
+    return NEGATIVE_SCORE_TTL if score == 0 else SCORE_TTL
+
+
+def compute_score(phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+    score = 0
     if phone:
         score += 1.5
     if email:
@@ -43,11 +89,44 @@ def get_score(store, phone, email, birthday=None, gender=None, first_name=None,
         score += 1.5
     if first_name and last_name:
         score += 0.5
-    # cache for 60 minutes
-    store.cache_set(key, score, 60 * 60)
     return score
 
 
+def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+    key = get_score_key(phone, email, birthday, gender, first_name, last_name)
+    # try get from cache,
+    # fallback to heavy calculation in case of cache miss
+    score = decode_score(store.cache_get(key))
+    if score is not None:
+        score_cache_stats.record(hits=1)
+        return score
+    score_cache_stats.record(misses=1)
+    score = compute_score(phone, email, birthday, gender, first_name, last_name)
+    store.cache_set(key, encode_score(score), get_score_ttl(score))
+    return score
+
+
+def get_scores(store, arguments_list):
+    # batch version of get_score: one multi-get for all keys, one multi-set for the misses,
+    # each written with its own ttl
+    keys = [get_score_key(**arguments) for arguments in arguments_list]
+    scores = [decode_score(value) for value in store.cache_get_many(keys)]
+    missing = []
+    for i, score in enumerate(scores):
+        if score is None:
+            scores[i] = compute_score(**arguments_list[i])
+            missing.append((keys[i], encode_score(scores[i]), get_score_ttl(scores[i])))
+    score_cache_stats.record(hits=len(scores) - len(missing), misses=len(missing))
+    if missing:
+        store.cache_set_many(missing)
+    return scores
+
+
 def get_interests(store, cid):
     r = store.get("i:%s" % cid)
     return json.loads(r) if r else []
+
+
+def get_interests_many(store, cids):
+    values = store.get_many(["i:%s" % cid for cid in cids])
+    return {cid: json.loads(r) if r else [] for cid, r in zip(cids, values)}
@@ -1,19 +1,32 @@
 
 import redis
 import functools
+import logging
+import random
+import threading
 import time
+from collections import OrderedDict
+from contextlib import contextmanager
 
 
-def retry(exceptions, tries=3, backoff_factor=0.3):
+def retry(exceptions, tries=3, backoff_factor=0.3, deadline=None):
+    # exponential backoff with full jitter; gives up early instead of sleeping past the deadline
     def decorator(f):
         @functools.wraps(f)
         def wrapper(*args, **kwargs):
+            start = time.monotonic()
             for attempt in range(tries):
                 try:
                     return f(*args, **kwargs)
                 except exceptions as e:
-                    delay = backoff_factor * (2 ** attempt)
-                    time.sleep(delay)
+                    error = e
+                if attempt == tries - 1:
+                    break
+                delay = random.uniform(0, backoff_factor * (2 ** attempt))
+                if deadline is not None and time.monotonic() - start + delay > deadline:
+                    break
+                time.sleep(delay)
+            logging.warning("%s failed after %s attempt(s): %r" % (f.__name__, attempt + 1, error))
 
         return wrapper
 
@@ -22,54 +35,214 @@ def retry(exceptions, tries=3, backoff_factor=0.3):
 
 class RedisStorage:
 
-    def __init__(self, host="localhost", port=6379, timeout=3):
+    def __init__(self, host="localhost", port=6379, timeout=3, max_connections=50, health_check_interval=30):
         self.host = host
         self.port = port
         self.timeout = timeout
+        self.max_connections = max_connections
+        self.health_check_interval = health_check_interval
         self.db = None
-        self.reconnect()
+        self.connect()
 
-    def reconnect(self):
+    def connect(self):
+        # the client owns a bounded connection pool shared by all threads of the process;
+        # connections idle for longer than health_check_interval are pinged before use
         self.db = redis.StrictRedis(
             host=self.host,
             port=self.port,
             db=0,
             socket_timeout=self.timeout,
             socket_connect_timeout=self.timeout,
-            decode_responses=True
+            decode_responses=True,
+            max_connections=self.max_connections,
+            health_check_interval=self.health_check_interval
         )
 
-    def get(self, key):
+    @contextmanager
+    def errors(self):
+        # redis errors become the builtin TimeoutError/ConnectionError that Storage retries on
         try:
-            return self.db.get(key)
+            yield
         except redis.exceptions.TimeoutError:
             raise TimeoutError
+        except redis.exceptions.MaxConnectionsError:
+            # every pooled connection is busy in other threads, the connections themselves are fine
+            raise ConnectionError
         except redis.exceptions.ConnectionError:
+            self.reconnect()
             raise ConnectionError
 
+    def reconnect(self):
+        # drop idle pooled connections, the next command opens a fresh one;
+        # connections busy in other threads are left to fail and get replaced on their own
+        self.db.connection_pool.disconnect(inuse_connections=False)
+
+    def get(self, key):
+        with self.errors():
+            return self.db.get(key)
+
+    def get_many(self, keys, chunk_size=1000):
+        # one MGET per chunk, all chunks sent in a single pipelined round-trip
+        with self.errors():
+            pipe = self.db.pipeline(transaction=False)
+            for i in range(0, len(keys), chunk_size):
+                pipe.mget(keys[i:i + chunk_size])
+            return [value for chunk in pipe.execute() for value in chunk]
+
+    @staticmethod
+    def pttl_to_expires(pttl):
+        # PTTL is -1 for a key without expiry and -2 for a missing key
+        return pttl / 1000 if pttl > 0 else None
+
+    def get_with_ttl(self, key):
+        # value and the seconds it has left, read in one round-trip
+        with self.errors():
+            pipe = self.db.pipeline(transaction=False)
+            pipe.get(key)
+            pipe.pttl(key)
+            value, pttl = pipe.execute()
+            return value, self.pttl_to_expires(pttl)
+
+    def get_many_with_ttl(self, keys, chunk_size=1000):
+        with self.errors():
+            pipe = self.db.pipeline(transaction=False)
+            for i in range(0, len(keys), chunk_size):
+                pipe.mget(keys[i:i + chunk_size])
+            for key in keys:
+                pipe.pttl(key)
+            results = pipe.execute()
+            n_chunks = len(results) - len(keys)
+            values = [value for chunk in results[:n_chunks] for value in chunk]
+            return [(value, self.pttl_to_expires(pttl)) for value, pttl in zip(values, results[n_chunks:])]
+
     def set(self, key, value, expires=None):
-        try:
+        with self.errors():
             return self.db.set(key, value, ex=expires)
-        except redis.exceptions.TimeoutError:
-            raise TimeoutError
-        except redis.exceptions.ConnectionError:
-            raise ConnectionError
+
+    def set_many(self, items):
+        # items are (key, value, expires) triples, all written in one pipeline
+        with self.errors():
+            pipe = self.db.pipeline(transaction=False)
+            for key, value, expires in items:
+                pipe.set(key, value, ex=expires)
+            return pipe.execute()
+
+
+class LocalCache:
+    # bounded in-process LRU; entries expire after `expires` seconds or `ttl`, whichever is shorter
+
+    def __init__(self, max_size=10000, ttl=60, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is not None and entry[1] <= self.clock():
+                del self.data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, expires=None):
+        ttl = min(expires, self.ttl) if expires else self.ttl
+        with self.lock:
+            self.data[key] = (value, self.clock() + ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self.data)}
 
 
 class Storage:
     MAX_RETRIES = 3
-    BACKOFF_FACTOR = 0.3
+    BACKOFF_FACTOR = 0.1
+    RETRY_DEADLINE = 0.5
+    GET_MANY_CHUNK_SIZE = 1000
 
-    def __init__(self, storage):
+    def __init__(self, storage, local_cache=None):
         self.storage = storage
+        self.local_cache = local_cache
 
     def get(self, key):
         return self.storage.get(key)
 
-    @retry((TimeoutError, ConnectionError), MAX_RETRIES, BACKOFF_FACTOR)
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return []
+        return self.storage.get_many(keys, self.GET_MANY_CHUNK_SIZE)
+
     def cache_get(self, key):
-        return self.storage.get(key)
+        if self.local_cache is not None:
+            value = self.local_cache.get(key)
+            if value is not None:
+                return value
+        # the local copy expires no later than the key in redis
+        value, expires = self.remote_cache_get(key) or (None, None)
+        if value is not None and self.local_cache is not None:
+            self.local_cache.set(key, value, expires)
+        return value
 
-    @retry((TimeoutError, ConnectionError), MAX_RETRIES, BACKOFF_FACTOR)
     def cache_set(self, key, value, expires=None):
-        return self.storage.set(key, value, expires=expires)
\ No newline at end of file
+        # the local tier is written first so it keeps working while redis is down
+        if self.local_cache is not None:
+            self.local_cache.set(key, value, expires)
+        return self.remote_cache_set(key, value, expires)
+
+    def cache_get_many(self, keys):
+        values = [None] * len(keys)
+        missing = []
+        for i, key in enumerate(keys):
+            if self.local_cache is not None:
+                values[i] = self.local_cache.get(key)
+            if values[i] is None:
+                missing.append(i)
+        if missing:
+            remote_values = self.remote_cache_get_many([keys[i] for i in missing]) or [(None, None)] * len(missing)
+            for i, (value, expires) in zip(missing, remote_values):
+                values[i] = value
+                if value is not None and self.local_cache is not None:
+                    self.local_cache.set(keys[i], value, expires)
+        return values
+
+    def cache_set_many(self, items):
+        items = list(items)
+        if not items:
+            return []
+        if self.local_cache is not None:
+            for key, value, expires in items:
+                self.local_cache.set(key, value, expires)
+        return self.remote_cache_set_many(items)
+
+    def local_cache_stats(self):
+        return self.local_cache.stats() if self.local_cache is not None else None
+
+    @retry((TimeoutError, ConnectionError), MAX_RETRIES, BACKOFF_FACTOR, RETRY_DEADLINE)
+    def remote_cache_get(self, key):
+        return self.storage.get_with_ttl(key)
+
+    @retry((TimeoutError, ConnectionError), MAX_RETRIES, BACKOFF_FACTOR, RETRY_DEADLINE)
+    def remote_cache_set(self, key, value, expires=None):
+        return self.storage.set(key, value, expires=expires)
+
+    @retry((TimeoutError, ConnectionError), MAX_RETRIES, BACKOFF_FACTOR, RETRY_DEADLINE)
+    def remote_cache_get_many(self, keys):
+        return self.storage.get_many_with_ttl(keys, self.GET_MANY_CHUNK_SIZE)
+
+    @retry((TimeoutError, ConnectionError), MAX_RETRIES, BACKOFF_FACTOR, RETRY_DEADLINE)
+    def remote_cache_set_many(self, items):
+        return self.storage.set_many(items)
@@ -0,0 +1,131 @@
+import asyncio
+import hashlib
+import http.client
+import json
+import threading
+import time
+import unittest
+
+import fakeredis
+from unittest.mock import patch
+
+import api
+import async_server
+import store
+
+
+class ServerThread:
+    def __init__(self, handler, concurrency=10, threads=1):
+        self.server = async_server.AsyncHTTPServer(handler, "localhost", 0, concurrency, threads=threads)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.server.start(), self.loop).result(5)
+        return self.server
+
+    def __exit__(self, *exc):
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+        self.loop.close()
+
+    async def shutdown(self):
+        self.server.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class TestAsyncServer(unittest.TestCase):
+    def post(self, conn, path, body):
+        conn.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        return response.status, response.getheader("Connection"), response.read()
+
+    def test_keep_alive(self):
+        calls = []
+
+        def handler(path, body, headers):
+            calls.append((path, body))
+            return 200, json.dumps({"n": len(calls)}).encode()
+
+        with ServerThread(handler) as server:
+            conn = http.client.HTTPConnection("localhost", server.port, timeout=5)
+            for i in range(1, 4):
+                status, connection, body = self.post(conn, "/method/", b'{"a": 1}')
+                self.assertEqual((status, connection, json.loads(body)), (200, "keep-alive", {"n": i}))
+            conn.close()
+        self.assertEqual(calls, [("/method/", b'{"a": 1}')] * 3)
+
+    def test_concurrency_limit(self):
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def handler(path, body, headers):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+            return 200, b"{}"
+
+        with ServerThread(handler, concurrency=2, threads=4) as server:
+            def client():
+                conn = http.client.HTTPConnection("localhost", server.port, timeout=5)
+                self.post(conn, "/method/", b"{}")
+                conn.close()
+            threads = [threading.Thread(target=client) for _ in range(6)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(len(peak), 6)
+        self.assertLessEqual(max(peak), 2)
+
+    def test_api_contract(self):
+        def handler(path, body, headers):
+            code, r = api.process_http_request(path, body, headers, store=None)
+            return code, bytes(json.dumps(r), "utf-8")
+
+        with ServerThread(handler) as server:
+            conn = http.client.HTTPConnection("localhost", server.port, timeout=5)
+            status, _, body = self.post(conn, "/method/", b"not json")
+            self.assertEqual((status, json.loads(body)), (api.BAD_REQUEST, {"error": "Bad Request", "code": 400}))
+            status, _, body = self.post(conn, "/unknown/", b'{"login": "h&f"}')
+            self.assertEqual((status, json.loads(body)), (api.NOT_FOUND, {"error": "Not Found", "code": 404}))
+            conn.close()
+
+    @patch("redis.StrictRedis", fakeredis.FakeStrictRedis)
+    def test_parallel_requests_keep_their_fields(self):
+        storage = store.Storage(store.RedisStorage())
+
+        def handler(path, body, headers):
+            code, r = api.process_http_request(path, body, headers, storage)
+            return code, bytes(json.dumps(r), "utf-8")
+
+        codes = []
+        with ServerThread(handler, threads=8) as server:
+            def client(login):
+                conn = http.client.HTTPConnection("localhost", server.port, timeout=5)
+                request = {"account": "horns&hoofs", "login": login, "method": "online_score",
+                           "token": hashlib.sha512(("horns&hoofs" + login + api.SALT).encode()).hexdigest(),
+                           "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}}
+                for _ in range(20):
+                    status, _, _ = self.post(conn, "/method/", json.dumps(request).encode())
+                    codes.append(status)
+                conn.close()
+            threads = [threading.Thread(target=client, args=("user%d" % i,)) for i in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(codes, [api.OK] * 160)
+
+
+if __name__ == "__main__":
+    unittest.main()
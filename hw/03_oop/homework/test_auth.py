@@ -0,0 +1,64 @@
+import datetime
+import hashlib
+import unittest
+from unittest.mock import patch
+
+import api
+import store
+
+
+def admin_token(dt):
+    return hashlib.sha512(bytes(dt.strftime("%Y%m%d%H") + api.ADMIN_SALT, "utf-8")).hexdigest()
+
+
+def make_request(**data):
+    request = api.MethodRequest(dict({"arguments": {}, "method": "online_score"}, **data))
+    request.validate()
+    return request
+
+
+class TestAdminDigest(unittest.TestCase):
+    def test_rolls_over_at_hour_boundary(self):
+        now = datetime.datetime(2017, 7, 19, 10, 59, 59)
+        digest = api.AdminDigest(clock=lambda: now.timestamp())
+        self.assertEqual(digest.get(), admin_token(now))
+        now = datetime.datetime(2017, 7, 19, 11, 0, 0)
+        self.assertEqual(digest.get(), admin_token(now))
+
+    def test_recomputed_once_per_hour(self):
+        calls = []
+        start = datetime.datetime(2017, 7, 19, 10, 0, 0).timestamp()
+
+        def clock():
+            calls.append(1)
+            return start + len(calls)
+
+        digest = api.AdminDigest(clock=clock)
+        first = digest.get()
+        self.assertTrue(all(digest.get() is first for _ in range(10)))
+
+
+class TestCheckAuth(unittest.TestCase):
+    def test_user(self):
+        token = hashlib.sha512(b"horns&hoofs" + b"h&f" + bytes(api.SALT, "utf-8")).hexdigest()
+        self.assertTrue(api.check_auth(make_request(account="horns&hoofs", login="h&f", token=token)))
+        self.assertFalse(api.check_auth(make_request(account="horns&hoofs", login="h&f", token=token[:-1])))
+        self.assertFalse(api.check_auth(make_request(account="horns&hoofs", login="h&f", token="токен")))
+
+    def test_admin(self):
+        token = admin_token(datetime.datetime.now())
+        self.assertTrue(api.check_auth(make_request(login=api.ADMIN_LOGIN, token=token)))
+        self.assertFalse(api.check_auth(make_request(login=api.ADMIN_LOGIN, token="")))
+
+    def test_only_valid_digests_are_cached(self):
+        with patch.object(api, "user_digests", store.LocalCache(max_size=1)):
+            token = api.user_digest("horns&hoofs", "h&f")
+            self.assertTrue(api.check_auth(make_request(account="horns&hoofs", login="h&f", token=token)))
+            for i in range(3):
+                self.assertFalse(api.check_auth(make_request(account="horns&hoofs", login="u%s" % i, token="x")))
+            self.assertEqual(api.user_digests.get(("horns&hoofs", "h&f")), token)
+            self.assertTrue(api.check_auth(make_request(account="horns&hoofs", login="h&f", token=token)))
+            self.assertEqual(api.user_digests.stats()["size"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import fakeredis
+
+import api
+import scoring
+import store
+
+
+class TestOnlineScoreBatch(unittest.TestCase):
+    @patch("redis.StrictRedis", fakeredis.FakeStrictRedis)
+    def setUp(self):
+        self.redis_storage = store.RedisStorage()
+        self.redis_storage.db.flushall()
+        self.store = store.Storage(self.redis_storage)
+        self.context = {}
+
+    def get_response(self, items, login="h&f"):
+        request = {"account": "horns&hoofs", "login": login, "method": "online_score_batch",
+                   "arguments": {"items": items}}
+        if login == api.ADMIN_LOGIN:
+            request["token"] = api.admin_digest.get()
+        else:
+            request["token"] = api.user_digest("horns&hoofs", login)
+        return api.method_handler({"body": request, "headers": {}}, self.context, self.store)
+
+    def test_results_in_order(self):
+        response, code = self.get_response([
+            {"phone": "79175002040", "email": "stupnikov@otus.ru"},
+            {"phone": "89175002040", "email": "stupnikov@otus.ru"},
+            {"first_name": "a", "last_name": "b"},
+            {},
+        ])
+        self.assertEqual(code, api.OK)
+        results = response["results"]
+        self.assertEqual([r["code"] for r in results], [api.OK, api.INVALID_REQUEST, api.OK, api.INVALID_REQUEST])
+        self.assertEqual(results[0]["response"], {"score": 3.0})
+        self.assertEqual(results[2]["response"], {"score": 0.5})
+        self.assertTrue(results[1]["error"])
+        self.assertEqual((self.context["nitems"], self.context["nvalid"]), (4, 2))
+
+    def test_single_round_trip_per_direction(self):
+        items = [{"phone": "7917500%04d" % i, "email": "a@b.ru"} for i in range(50)]
+        self.store.remote_cache_get_many = MagicMock(wraps=self.store.remote_cache_get_many)
+        self.store.remote_cache_set_many = MagicMock(wraps=self.store.remote_cache_set_many)
+        self.redis_storage.get = MagicMock(side_effect=AssertionError("single GET issued"))
+        first, _ = self.get_response(items)
+        second, _ = self.get_response(items)
+        self.assertEqual(first, second)
+        self.assertEqual(self.store.remote_cache_get_many.call_count, 2)
+        self.assertEqual(self.store.remote_cache_set_many.call_count, 1)
+
+    @patch.object(scoring, "score_cache_stats", scoring.CacheStats())
+    def test_cache_stats_in_context(self):
+        self.store.local_cache = store.LocalCache()
+        items = [{"phone": "79175002040", "email": "a@b.ru"}]
+        self.get_response(items)
+        self.get_response(items)
+        self.assertEqual(self.context["local_cache"], {"hits": 1, "misses": 1, "evictions": 0, "size": 1})
+        self.assertEqual(self.context["score_cache_hit_ratio"], 0.5)
+
+    def test_admin(self):
+        response, code = self.get_response([{"phone": "79175002040", "email": "stupnikov@otus.ru"}] * 3,
+                                           login=api.ADMIN_LOGIN)
+        self.assertEqual(code, api.OK)
+        self.assertEqual([r["response"]["score"] for r in response["results"]], [42] * 3)
+
+    def test_invalid_batch(self):
+        for items in [[], "x", [1, 2], [{}] * (api.MAX_BATCH_SIZE + 1)]:
+            _, code = self.get_response(items)
+            self.assertEqual(code, api.INVALID_REQUEST, items)
+
+    def test_get_scores_matches_compute_score(self):
+        arguments_list = [{"phone": "79175002040", "email": "a@b.ru", "birthday": None, "gender": None,
+                           "first_name": None, "last_name": None},
+                          {"phone": None, "email": None, "birthday": "01.01.2000", "gender": 1,
+                           "first_name": "a", "last_name": "b"}]
+        expected = [scoring.compute_score(**arguments) for arguments in arguments_list]
+        self.assertEqual(scoring.get_scores(self.store, arguments_list), expected)
+        self.assertEqual(scoring.get_scores(self.store, arguments_list), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
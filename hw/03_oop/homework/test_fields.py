@@ -50,6 +50,34 @@ class TestBirthdayField(unittest.TestCase):
         with self.assertRaises(ValueError):
             api.BirthDayField().validate(value)
 
+class TestParseDate(unittest.TestCase):
+    @cases([("19.07.2017", datetime.date(2017, 7, 19)), ("01.01.2000", datetime.date(2000, 1, 1)),
+            ("29.02.2016", datetime.date(2016, 2, 29))])
+    def test_valid_date(self, value, expected):
+        self.assertEqual(api.parse_date(value), expected)
+
+    @cases(["31.02.2017", "29.02.2017", "1.7.2017", "19-07-2017", "19.07.17", "2017.07.19", " 9.07.2017",
+            "19.13.2017", "00.01.2017", "aa.bb.cccc"])
+    def test_invalid_date(self, value):
+        with self.assertRaises(ValueError):
+            api.parse_date(value)
+
+    def test_today_rolls_over_at_midnight(self):
+        now = datetime.datetime(2017, 7, 19, 23, 59, 59)
+        today = api.Today(clock=lambda: now.timestamp())
+        self.assertEqual(today.get(), datetime.date(2017, 7, 19))
+        now = datetime.datetime(2017, 7, 20, 0, 0, 0)
+        self.assertEqual(today.get(), datetime.date(2017, 7, 20))
+
+    @cases(["01.01.1890", "XXX", "31.02.2000"])
+    def test_invalid_birthday_and_date(self, value):
+        with self.assertRaises(ValueError):
+            api.BirthDayField().validate(value)
+        if value != "01.01.1890":
+            with self.assertRaises(ValueError):
+                api.DateField().validate(value)
+
+
 class TestGenderField(unittest.TestCase):
     @cases([1])
     def test_valid_gender(self, value):
@@ -61,5 +89,57 @@ class TestGenderField(unittest.TestCase):
             api.GenderField().validate(value)
 
 
+class TestRequest(unittest.TestCase):
+    def test_values_are_per_instance(self):
+        first = api.OnlineScoreRequest({"phone": "79175002040", "email": "a@b.ru"})
+        second = api.OnlineScoreRequest({"first_name": "a", "last_name": "b"})
+        first.validate()
+        second.validate()
+        self.assertEqual((first.phone, first.first_name), ("79175002040", None))
+        self.assertEqual((second.phone, second.first_name), (None, "a"))
+        self.assertIsInstance(api.OnlineScoreRequest.phone, api.PhoneField)
+
+    def test_slots(self):
+        request = api.MethodRequest({})
+        self.assertFalse(hasattr(request, "__dict__"))
+        with self.assertRaises(AttributeError):
+            request.unknown = 1
+
+    def test_fields_are_collected_once(self):
+        self.assertEqual([f.name for f in api.MethodRequest.fields],
+                         ["account", "login", "token", "arguments", "method"])
+        self.assertEqual(len(api.MethodRequest.validators), 5)
+
+    @cases([
+        ({"login": "h&f", "token": "", "arguments": {}, "method": "online_score"}, []),
+        ({"login": "h&f", "arguments": {}, "method": "online_score"}, ["token: Field is required"]),
+        ({"login": "h&f", "token": "", "arguments": {}, "method": ""}, ["method: Field can't be empty"]),
+        ({"login": 1, "token": "", "arguments": "x", "method": "online_score"},
+         ["login: Should be a string", "arguments: Should be a dict"]),
+    ])
+    def test_method_request_errors(self, data, errors):
+        request = api.MethodRequest(data)
+        request.validate()
+        self.assertEqual(request.errors, errors)
+        self.assertEqual(request.is_valid, not errors)
+
+    @cases([
+        {},
+        {"phone": "79175002040"},
+        {"phone": "79175002040", "email": ""},
+        {"gender": 1, "first_name": "a"},
+    ])
+    def test_online_score_requires_pair(self, data):
+        request = api.OnlineScoreRequest(data)
+        request.validate()
+        self.assertFalse(request.is_valid)
+
+    def test_online_score_gender_zero_counts(self):
+        request = api.OnlineScoreRequest({"gender": 0, "birthday": "01.01.2000"})
+        request.validate()
+        self.assertTrue(request.is_valid)
+        self.assertEqual(sorted(request.check_non_empty()), ["birthday", "gender"])
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
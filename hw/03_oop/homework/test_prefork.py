@@ -0,0 +1,88 @@
+import http.client
+import multiprocessing
+import os
+import signal
+import time
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import prefork
+
+
+class PidHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = str(os.getpid()).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(server):
+    server.serve_forever()
+
+
+def supervise(server, n_workers):
+    prefork.MIN_WORKER_LIFETIME = 0
+    prefork.run(lambda: serve(server), n_workers)
+
+
+class TestPrefork(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(("localhost", 0), PidHandler)
+        self.port = self.server.server_address[1]
+        self.supervisor = multiprocessing.get_context("fork").Process(target=supervise, args=(self.server, 2))
+        self.supervisor.start()
+        self.server.server_close()
+
+    def tearDown(self):
+        if self.supervisor.is_alive():
+            self.supervisor.terminate()
+        self.supervisor.join(5)
+
+    def get_pid(self):
+        conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+        conn.request("POST", "/")
+        pid = int(conn.getresponse().read())
+        conn.close()
+        return pid
+
+    def wait_for_pids(self, n, timeout=5):
+        pids = set()
+        deadline = time.monotonic() + timeout
+        while len(pids) < n and time.monotonic() < deadline:
+            pids.add(self.get_pid())
+        return pids
+
+    def test_workers_share_socket(self):
+        pids = self.wait_for_pids(2)
+        self.assertEqual(len(pids), 2)
+        self.assertNotIn(self.supervisor.pid, pids)
+
+    def test_crashed_worker_is_restarted(self):
+        pid = self.get_pid()
+        os.kill(pid, signal.SIGKILL)
+        deadline = time.monotonic() + 5
+        pids = set()
+        while len(pids - {pid}) < 2 and time.monotonic() < deadline:
+            try:
+                pids.add(self.get_pid())
+            except (ConnectionError, http.client.HTTPException):
+                pass
+        self.assertEqual(len(pids - {pid}), 2)
+
+    def test_sigterm_stops_workers(self):
+        pids = self.wait_for_pids(2)
+        os.kill(self.supervisor.pid, signal.SIGTERM)
+        self.supervisor.join(5)
+        self.assertEqual(self.supervisor.exitcode, 0)
+        for pid in pids:
+            with self.assertRaises(ProcessLookupError):
+                os.kill(pid, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
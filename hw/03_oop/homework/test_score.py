@@ -1,10 +1,24 @@
+import functools
 import unittest
 from unittest.mock import patch, MagicMock
 import fakeredis
+import redis
 
+import scoring
 import store
 
 
+def cases(cases):
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args):
+            for c in cases:
+                new_args = args + (c if isinstance(c, tuple) else (c,))
+                f(*new_args)
+        return wrapper
+    return decorator
+
+
 class TestStore(unittest.TestCase):
 
     @patch("redis.StrictRedis", fakeredis.FakeStrictRedis)
@@ -27,15 +41,212 @@ class TestStore(unittest.TestCase):
     def test_retry_on_connection_error(self):
         redis_storage = store.RedisStorage()
         redis_storage.db.connected = False
-        redis_storage.db.get = MagicMock(side_effect=ConnectionError())
+        redis_storage.db.pipeline = MagicMock(side_effect=ConnectionError())
         redis_storage.db.set = MagicMock(side_effect=ConnectionError())
 
         storage = store.Storage(redis_storage)
         self.assertEqual(storage.cache_get("key"), None)
         self.assertEqual(storage.cache_set("key", "value"), None)
-        self.assertEqual(redis_storage.db.get.call_count, store.Storage.MAX_RETRIES)
+        self.assertEqual(redis_storage.db.pipeline.call_count, store.Storage.MAX_RETRIES)
         self.assertEqual(redis_storage.db.set.call_count, store.Storage.MAX_RETRIES)
 
+    @patch("redis.StrictRedis", fakeredis.FakeStrictRedis)
+    def test_get_many(self):
+        storage = store.Storage(store.RedisStorage())
+        storage.GET_MANY_CHUNK_SIZE = 2
+        for i in range(5):
+            storage.storage.set("key%s" % i, "value%s" % i)
+        keys = ["key%s" % i for i in range(6)]
+        self.assertEqual(storage.get_many(keys), ["value0", "value1", "value2", "value3", "value4", None])
+        self.assertEqual(storage.get_many([]), [])
+
+    @patch("redis.StrictRedis", fakeredis.FakeStrictRedis)
+    def test_get_many_raises_on_connection_error(self):
+        redis_storage = store.RedisStorage()
+        redis_storage.db.pipeline = MagicMock(side_effect=redis.exceptions.ConnectionError())
+        storage = store.Storage(redis_storage)
+        with self.assertRaises(ConnectionError):
+            storage.get_many(["key"])
+
+    @patch("redis.StrictRedis", fakeredis.FakeStrictRedis)
+    def test_get_interests_many(self):
+        storage = store.Storage(store.RedisStorage())
+        storage.storage.set("i:1", '["cars", "pets"]')
+        storage.storage.set("i:3", '["books"]')
+        self.assertEqual(scoring.get_interests_many(storage, [1, 2, 3]),
+                         {1: ["cars", "pets"], 2: [], 3: ["books"]})
+
+    @patch("redis.StrictRedis", fakeredis.FakeStrictRedis)
+    def test_pool_settings(self):
+        redis_storage = store.RedisStorage(max_connections=5, health_check_interval=10)
+        pool = redis_storage.db.connection_pool
+        self.assertEqual(pool.max_connections, 5)
+        self.assertEqual(pool.connection_kwargs["health_check_interval"], 10)
+
+    @patch("redis.StrictRedis", fakeredis.FakeStrictRedis)
+    def test_reconnect_on_connection_error(self):
+        redis_storage = store.RedisStorage()
+        redis_storage.db.get = MagicMock(side_effect=redis.exceptions.ConnectionError())
+        redis_storage.reconnect = MagicMock()
+        with self.assertRaises(ConnectionError):
+            redis_storage.get("key")
+        self.assertEqual(redis_storage.reconnect.call_count, 1)
+
+
+    @patch("redis.StrictRedis", fakeredis.FakeStrictRedis)
+    def test_no_reconnect_when_pool_is_exhausted(self):
+        redis_storage = store.RedisStorage(max_connections=1)
+        redis_storage.reconnect = MagicMock()
+        pool = redis_storage.db.connection_pool
+        connection = pool.get_connection()
+        with self.assertRaises(ConnectionError):
+            redis_storage.get("key")
+        self.assertEqual(redis_storage.reconnect.call_count, 0)
+        pool.release(connection)
+        self.assertEqual(redis_storage.get("key"), None)
+
+
+class TestRetry(unittest.TestCase):
+    def test_gives_up_at_deadline(self):
+        calls = []
+
+        @store.retry(ConnectionError, tries=10, backoff_factor=10, deadline=0.01)
+        def f():
+            calls.append(1)
+            raise ConnectionError()
+
+        with patch("random.uniform", side_effect=lambda a, b: b):
+            self.assertEqual(f(), None)
+        self.assertEqual(len(calls), 1)
+
+    def test_no_sleep_after_last_attempt(self):
+        @store.retry(ConnectionError, tries=2, backoff_factor=0.01)
+        def f():
+            raise ConnectionError()
+
+        with patch("time.sleep") as sleep:
+            self.assertEqual(f(), None)
+        self.assertEqual(sleep.call_count, 1)
+
+    def test_returns_after_recovery(self):
+        results = iter([ConnectionError(), "value"])
+
+        @store.retry(ConnectionError, tries=3, backoff_factor=0.01)
+        def f():
+            result = next(results)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        self.assertEqual(f(), "value")
+
+
+class TestScoreCache(unittest.TestCase):
+    @patch("redis.StrictRedis", fakeredis.FakeStrictRedis)
+    def setUp(self):
+        redis_storage = store.RedisStorage()
+        redis_storage.db.flushall()
+        self.store = store.Storage(redis_storage)
+        stats_patcher = patch.object(scoring, "score_cache_stats", scoring.CacheStats())
+        stats_patcher.start()
+        self.addCleanup(stats_patcher.stop)
+
+    def test_key_is_stable(self):
+        key = scoring.get_score_key("79175002040", "a@b.ru", "01.01.2000", 1, "a", "b")
+        self.assertEqual(key, scoring.get_score_key(79175002040, "a@b.ru", "01.01.2000", 1, "a", "b"))
+        self.assertEqual(len(key), len("score:") + 32)
+        self.assertNotEqual(key, scoring.get_score_key("79175002040", "c@d.ru", "01.01.2000", 1, "a", "b"))
+        self.assertNotEqual(scoring.get_score_key(None, None, first_name="ab", last_name="c"),
+                            scoring.get_score_key(None, None, first_name="a", last_name="bc"))
+
+    def test_score_is_cached(self):
+        self.assertEqual(scoring.get_score(self.store, "79175002040", "a@b.ru"), 3.0)
+        self.store.storage.set = MagicMock()
+        self.assertEqual(scoring.get_score(self.store, "79175002040", "a@b.ru"), 3.0)
+        self.assertEqual(self.store.storage.set.call_count, 0)
+        self.assertEqual(scoring.score_cache_stats.stats(), {"hits": 1, "misses": 1, "hit_ratio": 0.5})
+
+    def test_zero_score_is_cached(self):
+        self.store.cache_set = MagicMock(wraps=self.store.cache_set)
+        self.assertEqual(scoring.get_score(self.store, None, None, "01.01.2000", 0), 0)
+        self.assertEqual(scoring.get_score(self.store, None, None, "01.01.2000", 0), 0)
+        self.store.cache_set.assert_called_once_with(
+            scoring.get_score_key(None, None, "01.01.2000", 0), scoring.NO_SCORE, scoring.NEGATIVE_SCORE_TTL)
+        self.assertEqual(scoring.score_cache_stats.hits, 1)
+
+    def test_batch_writes_mixed_ttls_at_once(self):
+        self.store.cache_set_many = MagicMock(wraps=self.store.cache_set_many)
+        arguments = [{"phone": "79175002040", "email": "a@b.ru"}, {"birthday": "01.01.2000", "gender": 0},
+                     {"first_name": "a", "last_name": "b"}]
+        arguments = [dict(dict.fromkeys(["phone", "email", "birthday", "gender", "first_name", "last_name"]), **a)
+                     for a in arguments]
+        self.assertEqual(scoring.get_scores(self.store, arguments), [3.0, 0, 0.5])
+        self.assertEqual(self.store.cache_set_many.call_count, 1)
+        items = self.store.cache_set_many.call_args[0][0]
+        self.assertEqual([ttl for _, _, ttl in items],
+                         [scoring.SCORE_TTL, scoring.NEGATIVE_SCORE_TTL, scoring.SCORE_TTL])
+        self.assertEqual([0 < self.store.storage.db.ttl(key) <= ttl for key, _, ttl in items], [True] * 3)
+        self.assertEqual(scoring.get_scores(self.store, arguments), [3.0, 0, 0.5])
+        self.assertEqual(scoring.score_cache_stats.stats(), {"hits": 3, "misses": 3, "hit_ratio": 0.5})
+
+    @cases([(None, None), ("-", 0), ("3.0", 3.0), ("garbage", None)])
+    def test_decode_score(self, value, expected):
+        self.assertEqual(scoring.decode_score(value), expected)
+
+
+class TestLocalCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = store.LocalCache(max_size=2, ttl=60, clock=lambda: self.now)
+
+    def test_lru_eviction(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.cache.set("c", 3)
+        self.assertEqual(self.cache.get("b"), None)
+        self.assertEqual((self.cache.get("a"), self.cache.get("c")), (1, 3))
+        self.assertEqual(self.cache.stats(), {"hits": 3, "misses": 1, "evictions": 1, "size": 2})
+
+    def test_ttl(self):
+        self.cache.set("a", 1, expires=10)
+        self.cache.set("b", 2, expires=3600)
+        self.now = 30
+        self.assertEqual((self.cache.get("a"), self.cache.get("b")), (None, 2))
+        self.now = 60
+        self.assertEqual(self.cache.get("b"), None)
+
+    @patch("redis.StrictRedis", fakeredis.FakeStrictRedis)
+    def test_serves_local_tier_when_redis_is_down(self):
+        storage = store.Storage(store.RedisStorage(), self.cache)
+        # retry() swallows connection errors and returns None
+        storage.remote_cache_get = MagicMock(return_value=None)
+        storage.remote_cache_set = MagicMock(return_value=None)
+        storage.cache_set("key", 3.0, 60 * 60)
+        self.assertEqual(storage.cache_get("key"), 3.0)
+        self.assertEqual(storage.remote_cache_get.call_count, 0)
+
+    @patch("redis.StrictRedis", fakeredis.FakeStrictRedis)
+    def test_fills_local_tier_from_redis(self):
+        redis_storage = store.RedisStorage()
+        redis_storage.set("key", "3.0")
+        storage = store.Storage(redis_storage, self.cache)
+        self.assertEqual(storage.cache_get("key"), "3.0")
+        redis_storage.db.pipeline = MagicMock(side_effect=AssertionError("redis should not be hit"))
+        self.assertEqual(storage.cache_get("key"), "3.0")
+
+    @patch("redis.StrictRedis", fakeredis.FakeStrictRedis)
+    def test_local_copy_expires_with_redis_key(self):
+        redis_storage = store.RedisStorage()
+        redis_storage.set("short", "0", expires=10)
+        redis_storage.set("long", "3.0", expires=3600)
+        storage = store.Storage(redis_storage, self.cache)
+        self.assertEqual(storage.cache_get_many(["short", "long"]), ["0", "3.0"])
+        self.assertEqual(storage.cache_get("short"), "0")
+        redis_storage.db.flushall()
+        self.now = 30
+        self.assertEqual(storage.cache_get_many(["short", "long"]), [None, "3.0"])
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file